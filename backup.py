@@ -7,10 +7,10 @@ Coordinate system used will be (radius, longitude, latitude)
 """
 import numpy as np
 import time
-from multiprocessing.dummy import Pool as ThreadPool
 from object_file import Planetessimal, OptimisableValues, Paths
 import calculations as cal
 import image_processing as vis
+from optimiser import optimisation as parallel_optimisation
 
 NUMBER_OF_INITIAL_PLANETESSIMALS = 100
 NUMBER_OF_SIMULATIONS = 1000000
@@ -18,6 +18,7 @@ COMPOSITION_CLOUD = {"water": (0.9, 0.6), "rock": (3, 0.4), "hydrogen": (0.09, 0
 MASS_CONSTRAINTS = [1, 10]
 DISPLACEMENT_CONSTRAINTS = 1000
 STORAGE_ADDRESS = "sub_files/"
+DENSITY_REGIONS = []
 
 CONSTANT_VALUES = OptimisableValues(1, 0.0000000001, 0.1, 10, 1)
 
@@ -28,11 +29,11 @@ def main():
     run(CONSTANT_VALUES, seed, False)
 
 
-def run(constant_values, seed=1, optimising=True):
+def run(constant_values, seed=1, optimising=True, length_simulation=NUMBER_OF_SIMULATIONS):
     np.random.seed(seed)
     planetessimals = initialize(constant_values)
     start = time.process_time()
-    paths, objects_cleaned = accretion_disk(planetessimals, constant_values, not (optimising), NUMBER_OF_SIMULATIONS)
+    paths, objects_cleaned = accretion_disk(planetessimals, constant_values, not (optimising), length_simulation)
     time_finished = time.process_time() - start
     if not optimising:
         vis.display_final(NUMBER_OF_INITIAL_PLANETESSIMALS, time_finished, planetessimals, objects_cleaned)
@@ -54,7 +55,8 @@ def accretion_disk(planetessimals, constant_values, show_graphs, length_simulati
         for space_object in planetessimals:
             space_object.shift_center(planetessimals[0].displacement_vector)
         if i % constant_values.simulations_before_calculation == 0:
-            cal.calculate_collisions(planetessimals, gravitational_distance, constant_values.gravity, COMPOSITION_CLOUD)
+            cal.calculate_collisions(planetessimals, gravitational_distance, constant_values.gravity, COMPOSITION_CLOUD,
+                                     DENSITY_REGIONS)
             objects_cleaned += clean_list(planetessimals, constant_values)
         if i % 50000 == 0 and show_graphs:
             print("{} number of simulations have occured or {}%".format(i, 100 * i / length_simulation))
@@ -103,30 +105,11 @@ def clean_list(planetessimals, constant_values):  # needs more work
     return objects_removed
 
 
-def optimisation(pop_size, optimisation_number, constant_values):
-    """an optimisation algorithm that optimises for the best program performance"""
-    i = 0
-    best_pop = []
-    pop_values = []
-    for pop in range(pop_size):
-        pop_values.append(constant_values.return_variation())
-    while i < optimisation_number:
-        pool = ThreadPool()
-        results = pool.map(run, pop_values)
-        pool.close()
-        pool.join()
-        maximum_value = max(results)
-        index_value = results.index(maximum_value)
-        best_pop.clear()
-        best_pop.append(pop_values[index_value])
-        for pop in pop_values:
-            pop = best_pop[0].return_variation()
-        print("simulation {} with a maximum value {}".format(i, maximum_value))
-        i += 1
-    print(
-        "The best simulation had gravity {}, spin {}, maximum distance {}, acceleration error {}, simulations before calculation".format(
-            best_pop[0].gravity, best_pop[0].spin, best_pop[0].maximum_distance, best_pop[0].acceleration_error,
-            best_pop[0].simulations_before_calculation))
-
-
-main()
+def optimisation(pop_size, optimisation_number, constant_values, objective=run):
+    """an optimisation algorithm that optimises for the best program performance, every candidate of a
+    generation is run in its own process, objective is called with the values and a seed"""
+    return parallel_optimisation(pop_size, optimisation_number, constant_values, objective=objective)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""
+Scaling benchmark for the force engines
+Sweeps the number of particles, the number of steps and the force engine and saves the steps per second,
+the peak memory of a step and the drift of the energy and momentum of every configuration as json,
+so two commits can be compared with --compare.
+The legacy engine is the original object by object calculate_collisions loop.
+There is a list bellow
+run_configuration
+run_legacy
+compare
+"""
+import argparse
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+import calculations as cal
+from main import Simulation, CONSTANT_VALUES, COMPOSITION_CLOUD, DENSITY_REGIONS, DISPLACEMENT_CONSTRAINTS, SPECIES
+from object_file import Planetessimal, ParticleSystem
+from diagnostics import conservation_values
+
+SIZES = [100, 1000, 10000, 100000]
+STEPS = [10, 100]
+ENGINES = ["legacy", "direct", "barnes_hut", "neighbour_list", "parallel"]
+LEGACY_LIMIT = 2000
+ENERGY_LIMIT = 20000
+MEMORY_STEPS = 2
+TIME_BUDGET = 60.0
+REGRESSION = 0.1
+
+
+def run_configuration(number, steps, engine, integrator="euler", seed=1, budget=TIME_BUDGET):
+    """runs one configuration and returns its result, the run stops early once it has taken budget seconds"""
+    if engine == "legacy":
+        return run_legacy(number, steps, seed, budget)
+    simulation = Simulation(CONSTANT_VALUES, seed, True, engine, integrator, number_of_particles=number)
+    simulation.initialize()
+    energy, momentum = measure(simulation.particles, simulation.gravitational_distance, CONSTANT_VALUES.gravity)
+    start = time.perf_counter()
+    simulation.integrator.start(simulation.particles, lambda: simulation.interact(0))
+    done = 0
+    for i in range(steps):
+        simulation.calculate_displacements(None, i)
+        done += 1
+        if budget is not None and time.perf_counter() - start > budget:
+            break
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    for i in range(done, done + MEMORY_STEPS):
+        simulation.calculate_displacements(None, i)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    if hasattr(simulation.force_engine, "close"):
+        simulation.force_engine.close()
+    final_energy, final_momentum = measure(simulation.particles, simulation.gravitational_distance,
+                                           CONSTANT_VALUES.gravity)
+    return result(number, steps, engine, integrator, done, elapsed, peak, len(simulation.particles),
+                  energy, final_energy, momentum, final_momentum)
+
+
+def run_legacy(number, steps, seed, budget):
+    """runs the original list of planetessimals with calculate_collisions, the same update as the euler integrator"""
+    simulation = Simulation(CONSTANT_VALUES, seed, True, number_of_particles=number)
+    simulation.initialize()
+    planetessimals = []
+    for particle in simulation.particles:
+        planetessimal = Planetessimal(particle.id, particle.mass, particle.displacement_vector.copy(),
+                                      particle.velocity_vector.copy(), "hydrogen")
+        planetessimal.composition = dict(particle.composition)
+        planetessimal.radius = particle.radius
+        planetessimals.append(planetessimal)
+    energy, momentum = measure(simulation.particles, simulation.gravitational_distance, CONSTANT_VALUES.gravity)
+
+    def step(planetessimals):
+        for space_object in planetessimals:
+            space_object.calculate_displacement()
+        center = planetessimals[0].displacement_vector.copy()
+        for space_object in planetessimals:
+            space_object.shift_center(center)
+        cal.calculate_collisions(planetessimals, simulation.gravitational_distance, CONSTANT_VALUES.gravity,
+                                 COMPOSITION_CLOUD, DENSITY_REGIONS)
+        limit = DISPLACEMENT_CONSTRAINTS * CONSTANT_VALUES.maximum_distance
+        return [space_object for space_object in planetessimals
+                if space_object.mass != 0 and np.linalg.norm(space_object.displacement_vector) <= limit]
+
+    start = time.perf_counter()
+    done = 0
+    for i in range(steps):
+        planetessimals = step(planetessimals)
+        done += 1
+        if budget is not None and time.perf_counter() - start > budget:
+            break
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    for i in range(MEMORY_STEPS):
+        planetessimals = step(planetessimals)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    final_energy, final_momentum = measure(ParticleSystem.from_planetessimals(planetessimals, SPECIES),
+                                           simulation.gravitational_distance, CONSTANT_VALUES.gravity)
+    return result(number, steps, "legacy", "euler", done, elapsed, peak, len(planetessimals),
+                  energy, final_energy, momentum, final_momentum)
+
+
+def measure(particles, gravitational_distance, gravitational_constant):
+    """returns the total energy, or None for too many particles, and the total momentum,
+    the potential energy comes from one pass of the direct sum"""
+    values = conservation_values(particles)
+    if len(particles) > ENERGY_LIMIT:
+        return None, values["momentum"]
+    diagnostics = {"potential_energy": 0.0}
+    cal.calculate_accelerations(particles.displacements, particles.masses, particles.radii, gravitational_distance,
+                                gravitational_constant, diagnostics=diagnostics)
+    return values["kinetic_energy"] + diagnostics["potential_energy"], values["momentum"]
+
+
+def result(number, steps, engine, integrator, done, elapsed, peak, remaining, energy, final_energy, momentum,
+           final_momentum):
+    """returns the json record of one configuration"""
+    energy_drift = None
+    if energy is not None and final_energy is not None:
+        energy_drift = abs(final_energy - energy) / abs(energy) if energy else abs(final_energy)
+    return {
+        "particles": number,
+        "steps": steps,
+        "engine": engine,
+        "integrator": integrator,
+        "steps_done": done,
+        "seconds": elapsed,
+        "steps_per_second": done / elapsed if elapsed else None,
+        "peak_memory_bytes": peak,
+        "particles_left": remaining,
+        "energy_drift": energy_drift,
+        "momentum_drift": float(np.sqrt(((final_momentum - momentum) ** 2).sum()))
+    }
+
+
+def sweep(sizes=SIZES, steps=STEPS, engines=ENGINES, integrator="euler", seed=1, budget=TIME_BUDGET):
+    """runs every configuration and returns the results with a description of the machine and the commit"""
+    results = []
+    for number in sizes:
+        for step_count in steps:
+            for engine in engines:
+                if engine == "legacy" and number > LEGACY_LIMIT:
+                    continue
+                record = run_configuration(number, step_count, engine, integrator, seed, budget)
+                print("{particles:>7} particles {steps:>5} steps {engine:<15}{steps_per_second:>10.2f} steps/s "
+                      "{peak_memory_bytes:>12} bytes".format(**record))
+                results.append(record)
+    return {"commit": commit(), "python": platform.python_version(), "numpy": np.__version__,
+            "machine": platform.platform(), "results": results}
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(old, new, threshold=REGRESSION):
+    """returns the configurations that are more than threshold slower in new than in old"""
+    key = lambda record: (record["particles"], record["steps"], record["engine"], record["integrator"])
+    before = {key(record): record for record in old["results"]}
+    regressions = []
+    for record in new["results"]:
+        previous = before.get(key(record))
+        if previous is None or not previous["steps_per_second"] or not record["steps_per_second"]:
+            continue
+        ratio = record["steps_per_second"] / previous["steps_per_second"]
+        print("{} {:.2f}x".format(key(record), ratio))
+        if ratio < 1 - threshold:
+            regressions.append((key(record), ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmarks the force engines")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--steps", type=int, nargs="+", default=STEPS)
+    parser.add_argument("--engines", nargs="+", default=ENGINES)
+    parser.add_argument("--integrator", default="euler")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--budget", type=float, default=TIME_BUDGET)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", help="an earlier output to check for regressions")
+    arguments = parser.parse_args()
+    results = sweep(arguments.sizes, arguments.steps, arguments.engines, arguments.integrator, arguments.seed,
+                    arguments.budget)
+    with open(arguments.output, "w") as file:
+        json.dump(results, file, indent=1)
+    if arguments.compare:
+        with open(arguments.compare) as file:
+            regressions = compare(json.load(file), results)
+        for configuration, ratio in regressions:
+            print("regression {} is {:.2f}x as fast".format(configuration, ratio))
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,10 +4,18 @@ Created by Joseph Kent
 This file holds the main calculation functions
 There is a list bellow
 calculate_collisions
+calculate_particle_collisions
+resolve_collisions
+calculate_accretion
+calculate_accelerations
+calculate_target_accelerations
+calculate_overlaps
 calculate_distance
 """
 import numpy as np
 
+TILE_SIZE = 256
+
 
 def calculate_collisions(planetessimals, graviational_distance, gravitational_constant, chemical_properties, density_regions):
     """Calculates the collision if both objects clip each other"""
@@ -27,6 +35,220 @@ def calculate_collisions(planetessimals, graviational_distance, gravitational_co
                         planetessimals[i].velocity_vector = planetessimals[i].momentum() / (planetessimals[i].mass + amount)"""
 
 
+def calculate_particle_collisions(particles, gravitational_distance, gravitational_constant, chemical_properties,
+                                  density_regions, force_engine=None, counters=None, diagnostics=None, events=None):
+    """Calculates the accelerations of a particle system and collides every pair that clips each other,
+    the force engine is called with the particle arrays and returns the accelerations and clipping pairs,
+    absorbed particles are left with mass 0 until the next compaction,
+    if counters is given the engine adds how many pairs it evaluated to it and if diagnostics is given the
+    engine adds the potential energy of the pairs it evaluated to diagnostics["potential_energy"],
+    events is passed on to resolve_collisions"""
+    force_engine = calculate_accelerations if force_engine is None else force_engine
+    options = {}
+    if counters is not None:
+        options["counters"] = counters
+    if diagnostics is not None:
+        options["diagnostics"] = diagnostics
+    accelerations, pairs = force_engine(particles.displacements, particles.masses, particles.radii,
+                                        gravitational_distance, gravitational_constant, **options)
+    particles.accelerations[:] = accelerations
+    return resolve_collisions(particles, pairs, chemical_properties, events)
+
+
+def resolve_collisions(particles, pairs, chemical_properties, events=None):
+    """merges every cluster of clipping particles into the lowest slot of the cluster at once, keeping the mass,
+    momentum and composition, returns the survivor and the absorbed slot of every merge,
+    the radii come from the densities in the species table of the particles which is built from chemical_properties,
+    events is called with the particles and the survivor and absorbed slots before they are merged"""
+    if not len(pairs):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    number = len(particles)
+    union_find = UnionFind(number)
+    union_find.union(pairs)
+    roots = union_find.roots()
+    absorbed = np.flatnonzero(roots != np.arange(number))
+    survivors = roots[absorbed]
+    if events is not None:
+        events(particles, survivors, absorbed)
+    clusters = np.unique(survivors)
+    mass = np.bincount(roots, weights=particles.masses, minlength=number)[clusters]
+    momentum = particles.momentum()
+    for axis in range(3):
+        particles.velocities[clusters, axis] = np.bincount(
+            roots, weights=momentum[:, axis], minlength=number)[clusters] / np.where(mass > 0, mass, 1.0)
+    particles.masses[clusters] = mass
+    particles.masses[absorbed] = 0
+    np.add.at(particles.compositions, survivors, particles.compositions[absorbed])
+    particles.compositions[absorbed] = 0
+    particles.radii[clusters] = particles.species.radii(particles.compositions[clusters])
+    return survivors, absorbed
+
+
+def calculate_accretion(particles, density_table):
+    """adds the material every particle sweeps up from the density table in one pass, the material has no
+    momentum of its own so the particles slow down, returns the total mass added"""
+    distance = np.sqrt((particles.displacements ** 2).sum(axis=1))
+    amounts = density_table.accrete(distance, particles.masses)
+    gained = amounts.sum(axis=0)
+    changed = gained > 0
+    if not changed.any():
+        return 0.0
+    momentum = particles.momentum()[changed]
+    for curve, column in enumerate(density_table.columns):
+        particles.compositions[:, column] += amounts[curve]
+    particles.masses += gained
+    particles.velocities[changed] = momentum / particles.masses[changed, None]
+    particles.radii[changed] = particles.species.radii(particles.compositions[changed])
+    return float(gained.sum())
+
+
+class UnionFind:
+    """groups slots into clusters, the root of every cluster is its lowest slot"""
+    def __init__(self, number):
+        self.parent = np.arange(number)
+
+    def find(self, slot):
+        while self.parent[slot] != slot:
+            self.parent[slot] = self.parent[self.parent[slot]]
+            slot = self.parent[slot]
+        return slot
+
+    def union(self, pairs):
+        """joins the clusters of both slots in every pair"""
+        for first, second in pairs:
+            first, second = self.find(first), self.find(second)
+            if first != second:
+                self.parent[max(first, second)] = min(first, second)
+
+    def roots(self):
+        """returns the root of every slot"""
+        parent = self.parent
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                return parent
+            parent = grandparent
+
+
+def calculate_accelerations(displacements, masses, radii, gravitational_distance, gravitational_constant,
+                            tile_size=TILE_SIZE, start=0, stop=None, counters=None, diagnostics=None):
+    """returns the accelerations of the particles from start to stop and every pair (i, m) with i < m that clips,
+    working through tile_size by tile_size blocks of pairs so the memory used stays bounded,
+    the potential energy of the rows is added to diagnostics["potential_energy"] if diagnostics is given"""
+    number = len(masses)
+    stop = number if stop is None else stop
+    accelerations = np.zeros((stop - start, 3))
+    rows = []
+    columns = []
+    for i in range(start, stop, tile_size):
+        i_end = min(i + tile_size, stop)
+        for m in range(0, number, tile_size):
+            m_end = min(m + tile_size, number)
+            tile = interact_tile(displacements[i:i_end], masses[i:i_end], radii[i:i_end],
+                                 displacements[m:m_end], masses[m:m_end], radii[m:m_end],
+                                 gravitational_distance, gravitational_constant, diagnostics is not None)
+            tile_accelerations, overlap, within = tile[:3]
+            if diagnostics is not None:
+                diagnostics["potential_energy"] += 0.5 * float(masses[i:i_end] @ tile[3])
+            accelerations[i - start:i_end - start] += tile_accelerations
+            add_tile_pairs(overlap, i, m, rows, columns)
+            if counters is not None:
+                count_pairs(counters, np.arange(i, i_end)[:, None] < np.arange(m, m_end)[None, :], within)
+    return accelerations, join_pairs(rows, columns)
+
+
+def calculate_target_accelerations(displacements, masses, radii, targets, gravitational_distance,
+                                   gravitational_constant, tile_size=TILE_SIZE, counters=None):
+    """returns the accelerations of only the target slots, pairs that clip are left out but not collided,
+    if counters is given the pairs with a target in them that were evaluated are added to it"""
+    accelerations = np.zeros((len(targets), 3))
+    if counters is not None:
+        is_target = np.zeros(len(masses), dtype=bool)
+        is_target[targets] = True
+    for i in range(0, len(targets), tile_size):
+        rows = targets[i:i + tile_size]
+        for m in range(0, len(masses), tile_size):
+            m_end = min(m + tile_size, len(masses))
+            tile_accelerations, _, within = interact_tile(
+                displacements[rows], masses[rows], radii[rows],
+                displacements[m:m_end], masses[m:m_end], radii[m:m_end],
+                gravitational_distance, gravitational_constant)
+            accelerations[i:i + tile_size] += tile_accelerations
+            if counters is not None:
+                sources = np.arange(m, m_end)[None, :]
+                count_pairs(counters, (rows[:, None] < sources) | ((rows[:, None] > sources) & ~is_target[sources]),
+                            within)
+    return accelerations
+
+
+def calculate_overlaps(displacements, radii, tile_size=TILE_SIZE):
+    """returns every pair (i, m) with i < m that clips each other without calculating any gravity"""
+    number = len(radii)
+    rows = []
+    columns = []
+    for i in range(0, number, tile_size):
+        i_end = min(i + tile_size, number)
+        for m in range(i, number, tile_size):
+            m_end = min(m + tile_size, number)
+            direction = displacements[None, m:m_end] - displacements[i:i_end, None]
+            distance = np.sqrt((direction ** 2).sum(axis=-1))
+            add_tile_pairs(distance <= radii[i:i_end, None] + radii[None, m:m_end], i, m, rows, columns)
+    return join_pairs(rows, columns)
+
+
+def count_pairs(counters, evaluated, within, share=1):
+    """adds how many pairs were evaluated and how many of them were close enough to attract, evaluated masks the
+    pairs of within that count, None counts all of them.
+    Every engine counts unordered pairs of different particles, so a caller that evaluates both orders of a pair
+    masks one of them out and a one sided evaluation, like a leaf of the tree, is counted with a share of 0.5"""
+    if counters is not None:
+        if evaluated is not None:
+            within = within & evaluated
+        counters["pairs_evaluated"] += share * (within.size if evaluated is None else int(np.count_nonzero(evaluated)))
+        counters["pairs_within"] += share * int(np.count_nonzero(within))
+
+
+def add_tile_pairs(overlap, i, m, rows, columns):
+    """adds the clipping pairs of a tile starting at row i and column m, keeping each pair once"""
+    tile_rows, tile_columns = np.nonzero(overlap)
+    later = tile_rows + i < tile_columns + m
+    rows.append(tile_rows[later] + i)
+    columns.append(tile_columns[later] + m)
+
+
+def join_pairs(rows, columns):
+    """returns the pairs from every tile as an (P, 2) array sorted by the first then second index"""
+    if not rows:
+        return np.zeros((0, 2), dtype=np.int64)
+    pairs = np.stack([np.concatenate(rows), np.concatenate(columns)], axis=1).astype(np.int64)
+    return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+
+def interact_tile(target_displacements, target_masses, target_radii, source_displacements, source_masses,
+                  source_radii, gravitational_distance, gravitational_constant, potentials=False):
+    """returns the acceleration every source pulls on every target with, which pairs clip each other and
+    which pairs are close enough to attract, any leading axes are treated as separate systems,
+    with potentials the potential of every target per unit mass is returned as well"""
+    direction = [source_displacements[..., None, :, axis] - target_displacements[..., :, None, axis]
+                 for axis in range(3)]
+    distance = np.sqrt(direction[0] * direction[0] + direction[1] * direction[1] + direction[2] * direction[2])
+    overlap = distance <= target_radii[..., :, None] + source_radii[..., None, :]
+    within = ~overlap & (distance > 0) & ((distance < gravitational_distance * np.sqrt(source_masses)[..., None, :]) |
+                                          (distance < gravitational_distance * np.sqrt(target_masses)[..., :, None]))
+    safe_distance = np.where(within, distance, 1.0)
+    weights = np.where(within, gravitational_constant * source_masses[..., None, :] / safe_distance ** 3, 0.0)
+    accelerations = np.stack([(weights * component).sum(axis=-1) for component in direction], axis=-1)
+    if potentials:
+        return accelerations, overlap, within, -(weights * distance ** 2).sum(axis=-1)
+    return accelerations, overlap, within
+
+
+def add_rows(accelerations, rows, values):
+    """adds the values onto the rows of the accelerations, rows can repeat"""
+    for axis in range(3):
+        accelerations[:, axis] += np.bincount(rows, weights=values[:, axis], minlength=len(accelerations))
+
+
 def calculate_distance(vector1, vector2):
     """calculates the distance between the two vectors"""
     return np.linalg.norm(vector1 - vector2)
@@ -0,0 +1,65 @@
+"""
+Checkpoints of the whole state of a simulation
+A checkpoint is one .npz file with the particle arrays, the composition matrix and the rest of the state as json,
+it is written to a temporary file and moved over the old checkpoint so a crash never leaves half a file.
+There is a list bellow
+save_checkpoint
+load_checkpoint
+"""
+import json
+import os
+import numpy as np
+
+
+def save_checkpoint(path, simulation, density_regions):
+    """saves everything the simulation needs to carry on from its next step"""
+    particles = simulation.particles
+    state = {
+        "seed": simulation.seed,
+        "step": simulation.step,
+        "elapsed": simulation.elapsed,
+        "objects_cleaned": simulation.objects_cleaned,
+        "optimising": simulation.optimising,
+        "force_engine": simulation.force_engine_name,
+        "integrator": simulation.integrator_name,
+        "timestep": simulation.timestep,
+        "number_of_particles": simulation.number_of_particles,
+        "number_of_simulations": simulation.number_of_simulations,
+        "initial_conditions": simulation.initial_conditions,
+        "minimum_fitness": simulation.minimum_fitness,
+        "instrument": simulation.instrumentation.enabled,
+        "diagnostics_interval": simulation.diagnostics.interval,
+        "cache": None if simulation.cache is None else {"directory": simulation.cache.directory,
+                                                         "maximum_entries": simulation.cache.maximum_entries,
+                                                         "version": simulation.cache.version},
+        "constant_values": vars(simulation.constant_values),
+        "configuration": simulation.configuration(),
+        "species": particles.species.names,
+        "density_points": [list(curve.points.items()) for curve in density_regions],
+        "random_state": simulation.random.bit_generator.state
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    arrays = {}
+    if simulation.density_table is not None:
+        arrays["density_depletion"] = simulation.density_table.depletion
+    with open(path + ".tmp", "wb") as file:
+        np.savez(file, **arrays, ids=particles.ids, masses=particles.masses, radii=particles.radii,
+                 displacements=particles.displacements, velocities=particles.velocities,
+                 accelerations=particles.accelerations, compositions=particles.compositions,
+                 state=np.array(json.dumps(state, default=lambda value: value.item())))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def load_checkpoint(path):
+    """returns the arrays and the state saved by save_checkpoint as one dictionary"""
+    with np.load(path) as file:
+        state = json.loads(str(file["state"]))
+        for name in ("ids", "masses", "radii", "displacements", "velocities", "accelerations", "compositions"):
+            state[name] = file[name]
+        state["density_depletion"] = file["density_depletion"] if "density_depletion" in file else None
+    state["density_points"] = [{key: value for key, value in points} for points in state["density_points"]]
+    return state
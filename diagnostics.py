@@ -0,0 +1,116 @@
+"""
+Conservation diagnostics for long runs
+The potential energy comes out of the force pass itself, the kinetic energy, momentum and angular momentum are
+O(N) sums over the particle arrays, so a row of diagnostics costs about one extra step.
+Rows are written to a csv file every interval steps, drift is measured against the first row that was written.
+A new run starts a new file, a resumed run carries on the file from the step of its checkpoint.
+There is a list bellow
+Diagnostics
+conservation_values
+"""
+import os
+import numpy as np
+
+INTERVAL = 1000
+COLUMNS = ["step", "bodies", "kinetic_energy", "potential_energy", "total_energy", "energy_drift",
+           "momentum_x", "momentum_y", "momentum_z", "momentum_drift",
+           "angular_momentum_x", "angular_momentum_y", "angular_momentum_z", "angular_momentum_drift"]
+
+
+class Diagnostics:
+    """streams a row of diagnostics to path every interval steps, an interval of 0 turns them off,
+    resume_from carries on an existing file keeping only its rows before that step, otherwise it is replaced"""
+    def __init__(self, path, interval=INTERVAL, resume_from=None):
+        self.path = path
+        self.interval = interval
+        self.resume_from = resume_from
+        self.file = None
+        self.first = None
+        self.pass_values = None
+        if interval and resume_from is not None and os.path.exists(path):
+            self.truncate(resume_from)
+            self.load_first()
+
+    def truncate(self, step):
+        """removes the rows from step on, they are written again by the resumed run"""
+        with open(self.path) as file:
+            lines = file.readlines()
+        kept = lines[:1] + [line for line in lines[1:] if line.strip() and int(line.split(",", 1)[0]) < step]
+        with open(self.path + ".tmp", "w") as file:
+            file.writelines(kept)
+        os.replace(self.path + ".tmp", self.path)
+
+    def load_first(self):
+        """takes the reference values for the drift from the first row of an earlier stream"""
+        with open(self.path) as file:
+            names = file.readline().strip().split(",")
+            row = file.readline().strip()
+        if not row:
+            return
+        values = dict(zip(names, map(float, row.split(","))))
+        self.first = {"total_energy": values["total_energy"],
+                      "momentum": np.array([values["momentum_" + name] for name in "xyz"]),
+                      "angular_momentum": np.array([values["angular_momentum_" + name] for name in "xyz"])}
+
+    def due(self, step):
+        return bool(self.interval) and step % self.interval == 0
+
+    def start_pass(self):
+        """returns the dictionary the force engine adds the potential energy to"""
+        self.pass_values = {"potential_energy": 0.0}
+        return self.pass_values
+
+    def record(self, step, particles):
+        """writes the row for the step using the potential energy of the last force pass"""
+        if self.pass_values is None:
+            return None
+        values = conservation_values(particles)
+        values["potential_energy"] = float(self.pass_values["potential_energy"])
+        values["total_energy"] = values["kinetic_energy"] + values["potential_energy"]
+        self.pass_values = None
+        if self.first is None:
+            self.first = values
+        values["step"] = step
+        values["bodies"] = len(particles)
+        values["energy_drift"] = float(relative_change(values["total_energy"], self.first["total_energy"]))
+        values["momentum_drift"] = float(np.linalg.norm(values["momentum"] - self.first["momentum"]))
+        values["angular_momentum_drift"] = float(np.linalg.norm(values["angular_momentum"] -
+                                                                self.first["angular_momentum"]))
+        for axis, name in enumerate("xyz"):
+            values["momentum_" + name] = float(values["momentum"][axis])
+            values["angular_momentum_" + name] = float(values["angular_momentum"][axis])
+        self.write(values)
+        return values
+
+    def write(self, values):
+        if self.file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.file = open(self.path, "w" if self.resume_from is None else "a")
+            if not self.file.tell():
+                self.file.write(",".join(COLUMNS) + "\n")
+        self.file.write(",".join(str(values[name]) for name in COLUMNS) + "\n")
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def conservation_values(particles):
+    """returns the kinetic energy, the total momentum and the angular momentum around the centre of mass"""
+    masses = particles.masses
+    total_mass = masses.sum()
+    momentum = particles.momentum().sum(axis=0)
+    center = masses @ particles.displacements / total_mass if total_mass else np.zeros(3)
+    center_velocity = momentum / total_mass if total_mass else np.zeros(3)
+    angular_momentum = (masses[:, None] * np.cross(particles.displacements - center,
+                                                   particles.velocities - center_velocity)).sum(axis=0)
+    return {"kinetic_energy": float(0.5 * (masses * (particles.velocities ** 2).sum(axis=1)).sum()),
+            "momentum": momentum, "angular_momentum": angular_momentum}
+
+
+def relative_change(value, reference):
+    return abs(value - reference) / abs(reference) if reference else abs(value - reference)
@@ -0,0 +1,126 @@
+"""
+Runs many seeds of the same configuration together
+Every seed is a member of one flat particle system of seeds * particles slots that is viewed as
+(seeds, particles, 3) arrays, so a step is the same handful of array operations for every member.
+Merged and escaped particles stay in their slot but are masked out as dead.
+"""
+import time
+import numpy as np
+import calculations as cal
+import image_processing as vis
+from main import Simulation, COMPOSITION_CLOUD, DISPLACEMENT_CONSTRAINTS, NUMBER_OF_SIMULATIONS, TIMESTEP
+from object_file import ParticleSystem
+
+TILE_SIZE = 128
+ELEMENT_BUDGET = 1 << 17
+
+
+class Ensemble:
+    """the members use the direct sum and the euler integrator like the default Simulation,
+    a tile holds as many members as keep its (members, tile, tile, 3) arrays within element_budget floats"""
+    def __init__(self, constant_values, seeds, timestep=TIMESTEP, tile_size=TILE_SIZE, element_budget=ELEMENT_BUDGET):
+        self.constant_values = constant_values
+        self.seeds = list(seeds)
+        self.timestep = timestep
+        self.tile_size = tile_size
+        self.element_budget = element_budget
+        self.gravitational_distance = (constant_values.gravity / constant_values.acceleration_error) ** 0.5
+        members = []
+        for seed in self.seeds:
+            simulation = Simulation(constant_values, seed)
+            simulation.initialize()
+            members.append(simulation.particles)
+        self.number = len(members[0])
+        self.particles = ParticleSystem(np.arange(len(members) * self.number),
+                                        np.concatenate([member.masses for member in members]),
+                                        np.concatenate([member.radii for member in members]),
+                                        np.concatenate([member.displacements for member in members]),
+                                        np.concatenate([member.velocities for member in members]),
+                                        np.concatenate([member.compositions for member in members]),
+                                        members[0].species)
+        self.alive = np.ones((len(self.seeds), self.number), dtype=bool)
+        self.objects_cleaned = np.zeros(len(self.seeds), dtype=np.int64)
+        self.time_finished = 0
+
+    def view(self, values):
+        """returns the flat particle values as (seeds, particles, ...) arrays"""
+        return values.reshape((len(self.seeds), self.number) + values.shape[1:])
+
+    def run(self, number_of_simulations=NUMBER_OF_SIMULATIONS):
+        """runs every member and returns the fitness of every seed like Simulation.run"""
+        start = time.process_time()
+        for i in range(number_of_simulations):
+            self.step(i)
+        self.time_finished = (time.process_time() - start) / len(self.seeds)
+        return 1 / (self.objects_cleaned ** 2 * self.time_finished + self.time_finished)
+
+    def step(self, i):
+        """moves every member, recentres them and calculates the collisions"""
+        self.particles.velocities += self.particles.accelerations * self.timestep
+        self.particles.displacements += self.particles.velocities * self.timestep
+        displacements = self.view(self.particles.displacements)
+        center = displacements[np.arange(len(self.seeds)), np.argmax(self.alive, axis=1)].copy()
+        displacements -= center[:, None, :]
+        if i % self.constant_values.simulations_before_calculation == 0:
+            self.collision_calculations()
+            self.clean()
+
+    def collision_calculations(self):
+        """calculates the accelerations of every member at once and merges the clipping pairs"""
+        displacements = self.view(self.particles.displacements)
+        masses = self.view(self.particles.masses)
+        radii = np.where(self.alive, self.view(self.particles.radii), -np.inf)
+        accelerations = self.view(self.particles.accelerations)
+        accelerations[:] = 0
+        tile = max(1, min(self.tile_size, self.number))
+        members = max(1, self.element_budget // (3 * tile ** 2))
+        rows = []
+        columns = []
+        for first in range(0, len(self.seeds), members):
+            last = min(first + members, len(self.seeds))
+            for i in range(0, self.number, self.tile_size):
+                i_end = min(i + self.tile_size, self.number)
+                for m in range(0, self.number, self.tile_size):
+                    m_end = min(m + self.tile_size, self.number)
+                    tile_accelerations, overlap, within = cal.interact_tile(
+                        displacements[first:last, i:i_end], masses[first:last, i:i_end], radii[first:last, i:i_end],
+                        displacements[first:last, m:m_end], masses[first:last, m:m_end], radii[first:last, m:m_end],
+                        self.gravitational_distance, self.constant_values.gravity)
+                    accelerations[first:last, i:i_end] += tile_accelerations
+                    member, tile_rows, tile_columns = np.nonzero(overlap)
+                    later = tile_rows + i < tile_columns + m
+                    offset = (member[later] + first) * self.number
+                    rows.append(offset + tile_rows[later] + i)
+                    columns.append(offset + tile_columns[later] + m)
+        accelerations[~self.alive] = 0
+        _, absorbed = cal.resolve_collisions(self.particles, cal.join_pairs(rows, columns), COMPOSITION_CLOUD)
+        self.kill(absorbed)
+
+    def clean(self):
+        """masks out every particle that is too far away and counts it for its member"""
+        distance = np.sqrt((self.view(self.particles.displacements) ** 2).sum(axis=2))
+        too_far = self.alive & (DISPLACEMENT_CONSTRAINTS * self.constant_values.maximum_distance < distance)
+        self.objects_cleaned += too_far.sum(axis=1)
+        self.kill(np.flatnonzero(too_far))
+
+    def kill(self, slots):
+        """marks flat slots as dead so they no longer pull, move or clip"""
+        self.alive.reshape(-1)[slots] = False
+        self.particles.masses[slots] = 0
+        self.particles.velocities[slots] = 0
+        self.particles.accelerations[slots] = 0
+
+    def member(self, index):
+        """returns the living particles of one member as their own particle system"""
+        slots = np.flatnonzero(self.alive[index]) + index * self.number
+        particles = self.particles
+        return ParticleSystem(slots - index * self.number, particles.masses[slots], particles.radii[slots],
+                              particles.displacements[slots], particles.velocities[slots],
+                              particles.compositions[slots], particles.species)
+
+    def display(self):
+        """displays the final objects of every seed"""
+        for index, seed in enumerate(self.seeds):
+            print("Seed {}".format(seed))
+            vis.display_final(self.number, self.time_finished, self.member(index),
+                              int(self.objects_cleaned[index]))
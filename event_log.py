@@ -0,0 +1,117 @@
+"""
+Log of every merge of a run
+Every merge is one row of columns: the step, the ids of the survivor and of the absorbed particle, both masses
+before the merge, the velocity of the absorbed particle relative to the survivor and its position.
+The rows go into preallocated column buffers that are saved as one .npz chunk when they are full,
+so recording a step costs a few array copies. The reader builds the merge tree of any particle from the log
+without running the simulation again.
+There is a list bellow
+EventLog
+EventLogReader
+"""
+import json
+import os
+import numpy as np
+from trajectory import write_index, INDEX_FILE
+
+CHUNK_ROWS = 65536
+COLUMNS = [("step", np.int64, ()), ("survivor", np.int64, ()), ("absorbed", np.int64, ()),
+           ("survivor_mass", float, ()), ("absorbed_mass", float, ()), ("relative_velocity", float, (3,)),
+           ("position", float, (3,))]
+
+
+class EventLog:
+    """records merges into directory, resume_from carries on an earlier log keeping only its chunks before that
+    step, the log has to be flushed when a checkpoint is saved so no chunk crosses it"""
+    def __init__(self, directory, chunk_rows=CHUNK_ROWS, resume_from=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.buffers = {name: np.empty((chunk_rows,) + shape, dtype=dtype) for name, dtype, shape in COLUMNS}
+        self.count = 0
+        self.chunks = []
+        if resume_from is not None and os.path.exists(os.path.join(directory, INDEX_FILE)):
+            self.chunks = [chunk for chunk in EventLogReader(directory).chunks if chunk["last"] < resume_from]
+
+    def record(self, step, particles, survivors, absorbed):
+        """adds a row for every absorbed slot, it has to be called before the particles are merged"""
+        values = {"step": np.full(len(absorbed), step, dtype=np.int64), "survivor": particles.ids[survivors],
+                  "absorbed": particles.ids[absorbed], "survivor_mass": particles.masses[survivors],
+                  "absorbed_mass": particles.masses[absorbed],
+                  "relative_velocity": particles.velocities[absorbed] - particles.velocities[survivors],
+                  "position": particles.displacements[absorbed]}
+        first = 0
+        while first < len(absorbed):
+            rows = min(len(absorbed) - first, len(self.buffers["step"]) - self.count)
+            for name, buffer in self.buffers.items():
+                buffer[self.count:self.count + rows] = values[name][first:first + rows]
+            self.count += rows
+            first += rows
+            if self.count == len(self.buffers["step"]):
+                self.flush()
+
+    def flush(self):
+        """saves the buffered rows as a chunk and updates the index"""
+        if not self.count:
+            return
+        name = "chunk_{:06d}".format(len(self.chunks))
+        np.savez(os.path.join(self.directory, name + ".npz"),
+                 **{column: buffer[:self.count] for column, buffer in self.buffers.items()})
+        self.chunks.append({"name": name, "first": int(self.buffers["step"][0]),
+                            "last": int(self.buffers["step"][self.count - 1]), "rows": self.count})
+        self.count = 0
+        write_index(self.directory, {"chunks": self.chunks})
+
+    def close(self):
+        self.flush()
+
+
+class EventLogReader:
+    """reads every chunk of an EventLog into one array per column"""
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE)) as file:
+            self.chunks = json.load(file)["chunks"]
+        self.columns = {name: np.zeros((0,) + shape, dtype=dtype) for name, dtype, shape in COLUMNS}
+        if self.chunks:
+            values = []
+            for chunk in self.chunks:
+                with np.load(os.path.join(directory, chunk["name"] + ".npz")) as file:
+                    values.append({name: file[name] for name, dtype, shape in COLUMNS})
+            self.columns = {name: np.concatenate([chunk[name] for chunk in values]) for name, dtype, shape in COLUMNS}
+        self.merges = None
+
+    def __len__(self):
+        return len(self.columns["step"])
+
+    def rows_of(self, id_value):
+        """returns the rows where the particle absorbed another one, in the order they happened"""
+        if self.merges is None:
+            order = np.argsort(self.columns["survivor"], kind="stable")
+            survivors = self.columns["survivor"][order]
+            self.merges = order, survivors
+        order, survivors = self.merges
+        return order[np.searchsorted(survivors, id_value):np.searchsorted(survivors, id_value, side="right")]
+
+    def lineage(self, id_value):
+        """returns the ids of the particle and of every particle that ended up in it"""
+        ids = [id_value]
+        position = 0
+        while position < len(ids):
+            ids.extend(self.columns["absorbed"][self.rows_of(ids[position])].tolist())
+            position += 1
+        return ids
+
+    def merge_tree(self, id_value):
+        """returns the particle as a dictionary with its merges, every merge holds the row of the log and the
+        merge tree of the particle it absorbed"""
+        tree = {"id": id_value, "merges": []}
+        pending = [tree]
+        while pending:
+            node = pending.pop()
+            for row in self.rows_of(node["id"]):
+                child = {"id": int(self.columns["absorbed"][row]), "merges": []}
+                merge = {name: self.columns[name][row].tolist() for name, dtype, shape in COLUMNS}
+                merge["tree"] = child
+                node["merges"].append(merge)
+                pending.append(child)
+        return tree
@@ -109,13 +109,12 @@ def convert(composition, mass):
 
 def clean_list(planetessimals, constant_values):
     """returns the array with all objects that have mass 0 or have a distance larger than 10*that of the initial size"""
-    objects_removed = 0
-    for space_object in planetessimals:
-        distance = cal.calculate_distance(space_object.displacement_vector, np.array([0, 0, 0]))
-        if space_object.mass == 0 or DISPLACEMENT_CONSTRAINTS * constant_values.maximum_distance < distance:
-            planetessimals.remove(space_object)
-            if DISPLACEMENT_CONSTRAINTS * constant_values.maximum_distance < distance:
-                objects_removed += 1
+    limit = DISPLACEMENT_CONSTRAINTS * constant_values.maximum_distance
+    distances = [cal.calculate_distance(space_object.displacement_vector, np.array([0, 0, 0]))
+                 for space_object in planetessimals]
+    objects_removed = sum(1 for distance in distances if limit < distance)
+    planetessimals[:] = [space_object for space_object, distance in zip(planetessimals, distances)
+                         if space_object.mass != 0 and distance <= limit]
     return objects_removed
 
 if __name__ == '__main__':
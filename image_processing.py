@@ -3,13 +3,46 @@ Processes all of the visual aspects of the system
 Joseph Kent
 30/04/2020
 """
+from particle_set import write_particle_set
 
 
-def display_final(number_of_initial_particles, time_finished, planetessimals, objects_cleaned):
-    """displays the final objects"""
+def display_final(number_of_initial_particles, time_finished, planetessimals, objects_cleaned, path=None,
+                  metadata=None):
+    """displays the final objects, a ParticleSystem is also written to path as a particle set if it is given"""
     print("Total time ellapsed to do {} simulations: {}".format(number_of_initial_particles, time_finished))
     print("With an initial {} planetessimals, there are now {}, {} were removed because they were to far".format(
         number_of_initial_particles,
         len(planetessimals), objects_cleaned))
+    if hasattr(planetessimals, "species_totals"):
+        print("The total mass of every chemical is {}".format(planetessimals.species_totals()))
     for space_object in planetessimals:
-        print(space_object)
\ No newline at end of file
+        print(space_object)
+    if path is not None:
+        write_particle_set(path, planetessimals, metadata)
+
+
+def display_trajectory(reader, start, stop, filename, storage_address, maximum_points=None):
+    """shows an image of all of the objects paths between two steps of a recorded trajectory,
+    using at most maximum_points steps"""
+    import matplotlib.pyplot as plt
+    draw_trajectory(plt.axes(projection='3d'), reader, start, stop, maximum_points)
+    # plt.savefig(storage_address + filename + ".png")
+    plt.show()
+
+
+def save_trajectory(reader, start, stop, filename, storage_address, maximum_points=None):
+    """draws the same image as display_trajectory without a window and saves it as a png in storage_address"""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    draw_trajectory(figure.add_subplot(projection='3d'), reader, start, stop, maximum_points)
+    figure.savefig(storage_address + filename + ".png")
+
+
+def draw_trajectory(ax, reader, start, stop, maximum_points=None):
+    """scatters every path onto 3d axes, the size of a point is the radius of the object"""
+    steps, values = reader.window(start, stop, maximum_points)
+    ax.grid(False)
+    for column in range(values.shape[1]):
+        ax.scatter3D(values[:, column, 0], values[:, column, 1], values[:, column, 2], s=values[:, column, 3])
@@ -0,0 +1,101 @@
+"""
+Timers and counters for the phases of the simulation loop
+Every phase is timed with perf_counter, the time spent in a phase started inside another phase is only counted
+for the inner one so the phases add up to the whole step. When instrumentation is disabled phase returns one
+shared empty context and nothing is counted.
+There is a list bellow
+Instrumentation
+Phase
+"""
+import contextlib
+import csv
+import json
+import time
+from collections import defaultdict
+
+NULL_PHASE = contextlib.nullcontext()
+
+
+class Instrumentation:
+    """keeps the total time of every phase and every counter, sample stores what changed since the last sample"""
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.stack = []
+        self.samples = []
+        self.last_times = {}
+        self.last_counters = {}
+
+    def phase(self, name):
+        """returns a context that times everything inside it as the phase"""
+        return Phase(self, name) if self.enabled else NULL_PHASE
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] += value
+
+    def counter_dictionary(self):
+        """returns the counters for the force engines to add to, or None when disabled"""
+        return self.counters if self.enabled else None
+
+    def sample(self, step, bodies):
+        """stores the time and counts of every phase since the last sample"""
+        sample = {"step": step, "bodies": bodies}
+        for name, value in self.times.items():
+            sample[name + "_seconds"] = value - self.last_times.get(name, 0.0)
+        for name, value in self.counters.items():
+            sample[name] = value - self.last_counters.get(name, 0)
+        self.last_times = dict(self.times)
+        self.last_counters = dict(self.counters)
+        self.samples.append(sample)
+        return sample
+
+    def summary(self):
+        """returns the share of the time of every phase and the totals of the counters as text"""
+        total = sum(self.times.values())
+        lines = ["{:<24}{:>12.3f}s{:>8.1f}%{:>12} calls".format(name, value, 100 * value / total if total else 0,
+                                                                 self.calls[name])
+                 for name, value in sorted(self.times.items(), key=lambda item: -item[1])]
+        lines += ["{:<24}{:>12}".format(name, value) for name, value in sorted(self.counters.items())]
+        return "\n".join(lines)
+
+    def write(self, path):
+        """saves the totals and the samples as json, or only the samples as csv if the path ends in .csv"""
+        if path.endswith(".csv"):
+            names = []
+            for sample in self.samples:
+                names += [name for name in sample if name not in names]
+            with open(path, "w", newline="") as file:
+                writer = csv.DictWriter(file, fieldnames=names, restval=0)
+                writer.writeheader()
+                writer.writerows(self.samples)
+            return
+        with open(path, "w") as file:
+            json.dump({"times": self.times, "calls": self.calls, "counters": self.counters,
+                       "samples": self.samples}, file, indent=1)
+
+
+class Phase:
+    """times one phase, the time of phases inside it is taken off"""
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.start = 0.0
+        self.inner = 0.0
+
+    def __enter__(self):
+        self.instrumentation.stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        elapsed = time.perf_counter() - self.start
+        stack = self.instrumentation.stack
+        stack.pop()
+        if stack:
+            stack[-1].inner += elapsed
+        self.instrumentation.times[self.name] += elapsed - self.inner
+        self.instrumentation.calls[self.name] += 1
+        return False
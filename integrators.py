@@ -0,0 +1,95 @@
+"""
+Integrators that move the particles forward by a timestep
+Every integrator gets a function that recentres the particles, calculates the collisions and sets the
+accelerations, block timesteps also get a function that returns the accelerations of only some slots.
+There is a list bellow
+Euler
+Leapfrog
+Yoshida
+BlockLeapfrog
+"""
+import numpy as np
+
+YOSHIDA_OUTER = 1 / (2 - 2 ** (1 / 3))
+YOSHIDA_INNER = -2 ** (1 / 3) / (2 - 2 ** (1 / 3))
+MAXIMUM_LEVEL = 6
+BLOCK_ACCURACY = 0.1
+
+
+class Euler:
+    """the original update, the velocity is kicked by the last acceleration then the particles drift"""
+    force_evaluations = 1
+
+    def start(self, particles, interact):
+        pass
+
+    def step(self, particles, timestep, interact, accelerate=None):
+        particles.velocities += particles.accelerations * timestep
+        particles.displacements += particles.velocities * timestep
+        interact()
+
+
+class Leapfrog:
+    """second order kick drift kick, the accelerations have to be known when it starts"""
+    force_evaluations = 1
+
+    def start(self, particles, interact):
+        interact()
+
+    def step(self, particles, timestep, interact, accelerate=None):
+        particles.velocities += particles.accelerations * (timestep / 2)
+        particles.displacements += particles.velocities * timestep
+        interact()
+        particles.velocities += particles.accelerations * (timestep / 2)
+
+
+class Yoshida(Leapfrog):
+    """fourth order integrator made of three leapfrog steps, one of them backwards in time"""
+    force_evaluations = 3
+
+    def step(self, particles, timestep, interact, accelerate=None):
+        for weight in (YOSHIDA_OUTER, YOSHIDA_INNER, YOSHIDA_OUTER):
+            Leapfrog.step(self, particles, weight * timestep, interact)
+
+
+class BlockLeapfrog(Leapfrog):
+    """leapfrog where every particle takes the largest step of timestep / 2 ** level that keeps
+    timestep * accuracy * sqrt(radius / acceleration) small, all particles meet again at the end of the step,
+    collisions are only calculated there"""
+    def __init__(self, maximum_level=MAXIMUM_LEVEL, accuracy=BLOCK_ACCURACY):
+        self.maximum_level = maximum_level
+        self.accuracy = accuracy
+        self.force_evaluations = 1
+
+    def levels(self, particles, timestep):
+        """returns the level of every particle, a particle on level k takes steps of timestep / 2 ** k"""
+        size = np.sqrt((particles.accelerations ** 2).sum(axis=1))
+        wanted = self.accuracy * np.sqrt(particles.radii / np.where(size > 0, size, np.inf))
+        with np.errstate(divide="ignore"):
+            levels = np.ceil(np.log2(timestep / np.where(wanted > 0, wanted, timestep)))
+        return np.clip(levels, 0, self.maximum_level).astype(np.int64)
+
+    def step(self, particles, timestep, interact, accelerate=None):
+        levels = self.levels(particles, timestep)
+        deepest = levels.max()
+        substeps = 2 ** deepest
+        fine_step = timestep / substeps
+        stride = 2 ** (deepest - levels)
+        own_step = timestep / 2.0 ** levels
+        evaluated = 0
+        for substep in range(substeps):
+            starting = substep % stride == 0
+            particles.velocities[starting] += particles.accelerations[starting] * (own_step[starting] / 2)[:, None]
+            particles.displacements += particles.velocities * fine_step
+            if substep == substeps - 1:
+                break
+            ending = np.flatnonzero((substep + 1) % stride == 0)
+            if len(ending):
+                particles.accelerations[ending] = accelerate(ending)
+                particles.velocities[ending] += particles.accelerations[ending] * (own_step[ending] / 2)[:, None]
+                evaluated += len(ending)
+        step_of_id = np.zeros(len(particles.slots))
+        step_of_id[particles.ids] = own_step
+        interact()
+        particles.velocities += particles.accelerations * (step_of_id[particles.ids] / 2)[:, None]
+        self.force_evaluations = 1 + evaluated / max(len(levels), 1)
@@ -5,18 +5,55 @@ Description: The main file for a project that generates a solar system with plan
 Coordinate system used will be (radius, longitude, latitude)
 
 """
+import functools
+import json
+import os
 import numpy as np
 import time
-from object_file import Planetessimal, OptimisableValues, Paths, DensityCurve
+from object_file import ParticleSystem, OptimisableValues, DensityCurve, DensityTable, SpeciesTable
 import calculations as cal
 import image_processing as vis
+from octree import BarnesHut
+from neighbour_list import NeighbourList
+from parallel_forces import ParallelDirect
+from integrators import Euler, Leapfrog, Yoshida, BlockLeapfrog
+from checkpoint import save_checkpoint, load_checkpoint
+from trajectory import PyramidRecorder, Stride, Adaptive
+from reporting import BackgroundReporter
+from instrumentation import Instrumentation
+from diagnostics import Diagnostics
+from particle_set import ParticleSetReader, digest
+from event_log import EventLog
+from result_cache import ResultCache
 
 NUMBER_OF_INITIAL_PLANETESSIMALS = 100
 NUMBER_OF_SIMULATIONS = 1000000
 COMPOSITION_CLOUD = {"water": (0.9, 0.6), "rock": (3.0, 0.4), "hydrogen": (0.09, 0)}
+SPECIES = SpeciesTable(COMPOSITION_CLOUD)
 MASS_CONSTRAINTS = [1.0, 10.0]
 DISPLACEMENT_CONSTRAINTS = 1000
 STORAGE_ADDRESS = "sub_files/"
+INITIAL_CONDITIONS = None
+FORCE_ENGINE = "direct"
+OPENING_ANGLE = 0.5
+NEIGHBOUR_SKIN = 20.0
+FORCE_WORKERS = 4
+INTEGRATOR = "euler"
+TIMESTEP = 1.0
+RECORDING_POINTS = 4000
+RECORDING_TOLERANCE = None
+RECORDING_LEVELS = 3
+DISPLAY_POINTS = 2000
+RECORD_EVENTS = True
+CHECKPOINT_INTERVAL = 50000
+REPORT_QUEUE_SIZE = 4
+REPORT_POLICY = "drop"
+INSTRUMENT = False
+STATS_INTERVAL = 10000
+EARLY_STOP_INTERVAL = 1000
+RESULT_CACHE = STORAGE_ADDRESS + "result_cache/"
+ACCRETION = False
+DIAGNOSTICS_INTERVAL = 1000
 CONSTANT_VALUES = OptimisableValues(
     gravity=1,
     acceleration_error=0.001,
@@ -32,99 +69,312 @@ DENSITY_REGIONS = [
 
 
 class Simulation:
-    def __init__(self, constant_values, seed=1, optimising=True):
-        np.random.seed(seed)
+    def __init__(self, constant_values, seed=1, optimising=True, force_engine=FORCE_ENGINE, integrator=INTEGRATOR,
+                 timestep=TIMESTEP, checkpoint_interval=CHECKPOINT_INTERVAL, instrument=INSTRUMENT,
+                 number_of_particles=NUMBER_OF_INITIAL_PLANETESSIMALS, diagnostics_interval=DIAGNOSTICS_INTERVAL,
+                 number_of_simulations=NUMBER_OF_SIMULATIONS, minimum_fitness=None, cache=None,
+                 accretion=ACCRETION, initial_conditions=INITIAL_CONDITIONS):
+        self.seed = seed
+        self.random = np.random.default_rng(seed)
         self.constant_values = constant_values
         self.optimising = optimising
-        self.planetessimals = []
+        self.force_engine_name = force_engine
+        self.integrator_name = integrator
+        self.force_engine = create_force_engine(force_engine)
+        self.integrator = create_integrator(integrator)
+        self.timestep = timestep
+        self.initial_conditions = initial_conditions
+        self.initial_conditions_digest = None if initial_conditions is None else digest(initial_conditions)
+        self.number_of_particles = number_of_particles if initial_conditions is None else \
+            len(ParticleSetReader(initial_conditions))
+        self.number_of_simulations = number_of_simulations
+        self.minimum_fitness = minimum_fitness
+        self.stopped_early = False
+        self.cache = cache if optimising else None
+        self.density_table = None
+        if accretion:
+            self.density_table = DensityTable(DENSITY_REGIONS, SPECIES,
+                                              DISPLACEMENT_CONSTRAINTS * constant_values.maximum_distance)
+        self.checkpoint_interval = 0 if optimising else checkpoint_interval
+        self.checkpoint_path = STORAGE_ADDRESS + "checkpoint_seed_{}.npz".format(seed)
+        self.particles = None
+        self.events = None
         self.objects_cleaned = 0
+        self.step = 0
+        self.elapsed = 0.0
+        self.started = 0.0
+        self.instrumentation = Instrumentation(instrument)
+        self.diagnostics = Diagnostics(STORAGE_ADDRESS + "diagnostics_seed_{}.csv".format(seed),
+                                       0 if optimising else diagnostics_interval)
         self.gravitational_distance = (self.constant_values.gravity / self.constant_values.acceleration_error) ** 0.5
 
+    @classmethod
+    def resume(cls, path, checkpoint_interval=CHECKPOINT_INTERVAL, configuration=None):
+        """returns the simulation saved in a checkpoint, run carries it on from the step after the checkpoint
+        exactly as if it had never stopped, if configuration is given a checkpoint made with a different one
+        raises a ValueError"""
+        state = load_checkpoint(path)
+        if configuration is not None and \
+                json.dumps(configuration, sort_keys=True, default=lambda value: value.item()) != \
+                json.dumps(state["configuration"], sort_keys=True):
+            raise ValueError("the checkpoint {} was made with a different configuration".format(path))
+        cache = None if state["cache"] is None else ResultCache(**state["cache"])
+        simulation = cls(OptimisableValues(**state["constant_values"]), state["seed"], state["optimising"],
+                         state["force_engine"], state["integrator"], state["timestep"], checkpoint_interval,
+                         state["instrument"], state["number_of_particles"], state["diagnostics_interval"],
+                         state["number_of_simulations"], state["minimum_fitness"], cache,
+                         state["density_depletion"] is not None, state["initial_conditions"])
+        simulation.checkpoint_path = path
+        simulation.particles = ParticleSystem(state["ids"], state["masses"], state["radii"], state["displacements"],
+                                              state["velocities"], state["compositions"], SPECIES)
+        simulation.particles.accelerations[:] = state["accelerations"]
+        simulation.objects_cleaned = state["objects_cleaned"]
+        simulation.step = state["step"]
+        simulation.elapsed = state["elapsed"]
+        simulation.diagnostics = Diagnostics(simulation.diagnostics.path, simulation.diagnostics.interval,
+                                             simulation.step)
+        if simulation.density_table is not None:
+            simulation.density_table.depletion[:] = state["density_depletion"]
+        for density_curve, points in zip(DENSITY_REGIONS, state["density_points"]):
+            density_curve.points = points
+        simulation.random.bit_generator.state = state["random_state"]
+        return simulation
+
     def run(self):
-        self.initialize()
-        start = time.process_time()
+        if self.cache is not None and self.step == 0:
+            result = self.cache.get(self.configuration())
+            if result is not None:
+                self.objects_cleaned = result["objects_cleaned"]
+                self.step = result["steps"]
+                return result["fitness"]
+        if self.particles is None:
+            self.initialize()
+        self.started = time.process_time() - self.elapsed
         self.accretion_disk()
-        time_finished = time.process_time() - start
+        time_finished = time.process_time() - self.started
+        if self.checkpoint_interval and self.step == self.number_of_simulations and \
+                os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        if hasattr(self.force_engine, "close"):
+            self.force_engine.close()
+        if self.instrumentation.enabled:
+            self.write_stats()
         if not self.optimising:
-            vis.display_final(NUMBER_OF_INITIAL_PLANETESSIMALS, time_finished, self.planetessimals,
-                              self.objects_cleaned)
-        return 1 / (self.objects_cleaned ** 2 * time_finished + time_finished)
+            vis.display_final(self.number_of_particles, time_finished, self.particles,
+                              self.objects_cleaned, STORAGE_ADDRESS + "final_seed_{}.pset".format(self.seed),
+                              {"seed": self.seed, "step": self.step, "objects_cleaned": self.objects_cleaned})
+        fitness = 1 / (self.objects_cleaned ** 2 * time_finished + time_finished)
+        if self.cache is not None and not self.stopped_early:
+            largest = np.argsort(self.particles.masses)[::-1][:10]
+            self.cache.put(self.configuration(), {
+                "fitness": fitness, "time": time_finished, "objects_cleaned": self.objects_cleaned,
+                "steps": self.step, "bodies": len(self.particles), "total_mass": float(self.particles.masses.sum()),
+                "largest": [[int(self.particles.ids[slot]), float(self.particles.masses[slot])] for slot in largest]})
+        return fitness
+
+    def configuration(self):
+        """returns everything that decides the result of a run, the result cache is keyed by it"""
+        return {"seed": self.seed, "constant_values": vars(self.constant_values),
+                "composition_cloud": COMPOSITION_CLOUD,
+                "density_regions": [[curve.resource, curve.amount, curve.minimum, curve.maximum, curve.threshold]
+                                    for curve in DENSITY_REGIONS],
+                "number_of_particles": self.number_of_particles, "number_of_simulations": self.number_of_simulations,
+                "force_engine": self.force_engine_name, "integrator": self.integrator_name,
+                "timestep": self.timestep, "accretion": self.density_table is not None,
+                "initial_conditions": self.initial_conditions_digest}
 
     def initialize(self):
-        self.planetessimals.append(Planetessimal(id_1=0, mass=1000, displacement_vector=np.array([0.0, 0.0, 0.0]),
-                                                 velocity_vector=np.array([0.0, 0.0, 0.0]), composition="hydrogen"))
-        for i in range(1, NUMBER_OF_INITIAL_PLANETESSIMALS):
-            mass = np.random.randint(low=MASS_CONSTRAINTS[0], high=MASS_CONSTRAINTS[1])
-            displacement_vector = np.array(
-                [np.random.uniform(-DISPLACEMENT_CONSTRAINTS, DISPLACEMENT_CONSTRAINTS),
-                 np.random.uniform(-DISPLACEMENT_CONSTRAINTS, DISPLACEMENT_CONSTRAINTS),
-                 np.random.uniform(-DISPLACEMENT_CONSTRAINTS, DISPLACEMENT_CONSTRAINTS)])
-            angle = np.random.uniform(0, 2 * np.pi)
-            velocity_vector = self.constant_values.spin * np.random.uniform(0, 1) * np.array(
-                [np.cos(angle), np.sin(angle), 0])
-            composition_element = np.random.choice([key for key in COMPOSITION_CLOUD.keys()], 1,
-                                                   p=[substance[1] for substance in COMPOSITION_CLOUD.values()])
-            self.planetessimals.append(Planetessimal(id_1=i, mass=mass, displacement_vector=displacement_vector,
-                                                     velocity_vector=velocity_vector,
-                                                     composition=str(composition_element[0])))
+        """creates the sun and number_of_particles - 1 planetessimals from the random generator of the seed,
+        every value is drawn for all of the planetessimals at once, or reads them from the initial_conditions file"""
+        if self.initial_conditions is not None:
+            self.particles = ParticleSetReader(self.initial_conditions).particles(species=SPECIES)
+            return
+        number = self.number_of_particles - 1
+        masses = np.concatenate([[1000.0], self.random.integers(MASS_CONSTRAINTS[0], MASS_CONSTRAINTS[1], number)])
+        displacements = np.zeros((number + 1, 3))
+        displacements[1:] = self.random.uniform(-DISPLACEMENT_CONSTRAINTS, DISPLACEMENT_CONSTRAINTS, (number, 3))
+        angles = self.random.uniform(0, 2 * np.pi, number)
+        speeds = self.constant_values.spin * self.random.uniform(0, 1, number)
+        velocities = np.zeros((number + 1, 3))
+        velocities[1:, 0] = speeds * np.cos(angles)
+        velocities[1:, 1] = speeds * np.sin(angles)
+        elements = self.random.choice([SPECIES.columns[name] for name in COMPOSITION_CLOUD.keys()], number,
+                                      p=[substance[1] for substance in COMPOSITION_CLOUD.values()])
+        compositions = np.zeros((number + 1, len(SPECIES)))
+        compositions[0, SPECIES.columns["hydrogen"]] = masses[0]
+        compositions[np.arange(1, number + 1), elements] = masses[1:]
+        self.particles = ParticleSystem(np.arange(number + 1), masses, masses ** 0.5, displacements,
+                                        velocities, compositions, SPECIES)
 
     def accretion_disk(self):
         """simulates the accretion disk and returns a list of the objects with their
         positions, velocities, accelerations, mass and composition"""
-        paths = Paths([particle.id for particle in self.planetessimals])
-        for i in range(NUMBER_OF_SIMULATIONS):
-            paths = self.calculate_displacements(paths)
-            self.shift_center()
-            self.collision_calculations(i)
+        recorder = None
+        reporter = None
+        if not self.optimising:
+            reporter = BackgroundReporter(STORAGE_ADDRESS, REPORT_QUEUE_SIZE, REPORT_POLICY)
+            recorder = PyramidRecorder(STORAGE_ADDRESS + "trajectory_seed_{}".format(self.seed), self.particles.ids,
+                                       RECORDING_LEVELS, policy=create_recording_policy(self.number_of_simulations),
+                                       resume_from=self.step if self.step else None)
+            if RECORD_EVENTS:
+                self.events = EventLog(STORAGE_ADDRESS + "events_seed_{}".format(self.seed),
+                                       resume_from=self.step if self.step else None)
+        window_start = self.step
+        if self.step == 0:
+            self.integrator.start(self.particles, lambda: self.interact(0))
+        for i in range(self.step, self.number_of_simulations):
+            self.calculate_displacements(recorder, i)
+            self.step = i + 1
+            if self.checkpoint_interval and self.step % self.checkpoint_interval == 0:
+                with self.instrumentation.phase("checkpoint"):
+                    self.checkpoint(recorder)
+            if self.instrumentation.enabled and self.step % STATS_INTERVAL == 0:
+                self.instrumentation.sample(self.step, len(self.particles))
+                (print if reporter is None else reporter.progress)(self.instrumentation.summary())
             if i % 50000 == 0 and not self.optimising:
-                print("{} number of simulations have occured or {}%".format(i, 100 * i / NUMBER_OF_SIMULATIONS))
-                paths.display(
-                    "percentage_{}_for_{}_particles_and_{}_simulations".format(100 * i / NUMBER_OF_SIMULATIONS,
-                                                                               NUMBER_OF_INITIAL_PLANETESSIMALS,
-                                                                               NUMBER_OF_SIMULATIONS),
-                    STORAGE_ADDRESS)
-                paths = Paths([particle.id for particle in self.planetessimals])
+                reporter.progress("{} number of simulations have occured or {}%".format(
+                    i, 100 * i / self.number_of_simulations))
+                recorder.flush()
+                reporter.trajectory(
+                    recorder.directory, window_start, i + 1,
+                    "percentage_{}_for_{}_particles_and_{}_simulations".format(
+                        100 * i / self.number_of_simulations, self.number_of_particles, self.number_of_simulations),
+                    DISPLAY_POINTS)
+                window_start = i + 1
+            if self.minimum_fitness is not None and self.step % EARLY_STOP_INTERVAL == 0 and \
+                    self.fitness_bound() < self.minimum_fitness:
+                self.stopped_early = True
+                break
+        if recorder is not None:
+            recorder.close()
+            reporter.close()
+        if self.events is not None:
+            self.events.close()
+            self.events = None
+        self.diagnostics.close()
+
+    def fitness_bound(self):
+        """returns the fitness if the run stopped now, objects cleaned and the time only grow so the final fitness
+        can't be any higher"""
+        time_so_far = max(time.process_time() - self.started, 1e-9)
+        return 1 / (self.objects_cleaned ** 2 * time_so_far + time_so_far)
+
+    def checkpoint(self, recorder):
+        """saves the state after the current step, the trajectory and the event log are flushed first so they match
+        the checkpoint"""
+        if recorder is not None:
+            recorder.flush()
+        if self.events is not None:
+            self.events.flush()
+        self.elapsed = time.process_time() - self.started
+        save_checkpoint(self.checkpoint_path, self, DENSITY_REGIONS)
+
+    def write_stats(self):
+        """saves the phase times and counters as json and the samples as csv"""
+        os.makedirs(STORAGE_ADDRESS, exist_ok=True)
+        if not self.instrumentation.samples or self.instrumentation.samples[-1]["step"] != self.step:
+            self.instrumentation.sample(self.step, len(self.particles))
+        for extension in ("json", "csv"):
+            self.instrumentation.write(STORAGE_ADDRESS + "stats_seed_{}.{}".format(self.seed, extension))
 
     def shift_center(self):
-        center = self.planetessimals[0].displacement_vector
-        for space_object in self.planetessimals:
-            space_object.shift_center(center)
+        self.particles.shift_center(self.particles.displacements[0].copy())
+
+    def calculate_displacements(self, recorder, i):
+        if recorder is not None:
+            with self.instrumentation.phase("record"):
+                recorder.add(i, self.particles)
+        with self.instrumentation.phase("calculate_displacements"):
+            self.integrator.step(self.particles, self.timestep, lambda: self.interact(i), self.accelerate)
+        if self.diagnostics.due(i):
+            with self.instrumentation.phase("diagnostics"):
+                self.diagnostics.record(i, self.particles)
 
-    def calculate_displacements(self, paths):
-        for space_object in self.planetessimals:
-            if not self.optimising:
-                paths.add(space_object.id, list(space_object.displacement_vector), space_object.radius)
-            space_object.calculate_displacement()
-        return paths
+    def interact(self, i):
+        """recentres the particles and calculates the collisions, the integrator calls this for new accelerations"""
+        with self.instrumentation.phase("shift_center"):
+            self.shift_center()
+        self.collision_calculations(i)
+
+    def accelerate(self, slots):
+        """returns the accelerations of only some slots for the block timesteps from the force engine"""
+        target_accelerations = getattr(self.force_engine, "target_accelerations", cal.calculate_target_accelerations)
+        return target_accelerations(self.particles.displacements, self.particles.masses, self.particles.radii, slots,
+                                    self.gravitational_distance, self.constant_values.gravity,
+                                    counters=self.instrumentation.counter_dictionary())
 
     def collision_calculations(self, i):
         if i % self.constant_values.simulations_before_calculation == 0:
-            cal.calculate_collisions(self.planetessimals, self.gravitational_distance, self.constant_values.gravity,
-                                     COMPOSITION_CLOUD, DENSITY_REGIONS)
-            self.objects_cleaned += clean_list(self.planetessimals, self.constant_values)
+            with self.instrumentation.phase("collision_calculations"):
+                survivors, absorbed = cal.calculate_particle_collisions(
+                    self.particles, self.gravitational_distance, self.constant_values.gravity, COMPOSITION_CLOUD,
+                    DENSITY_REGIONS, self.force_engine, self.instrumentation.counter_dictionary(),
+                    self.diagnostics.start_pass() if self.diagnostics.due(i) else None,
+                    None if self.events is None else functools.partial(self.events.record, i))
+            with self.instrumentation.phase("clean_list"):
+                removed = clean_list(self.particles, self.constant_values)
+            self.objects_cleaned += removed
+            if self.density_table is not None:
+                with self.instrumentation.phase("accretion"):
+                    cal.calculate_accretion(self.particles, self.density_table)
+            self.instrumentation.count("collisions", len(absorbed))
+            self.instrumentation.count("removals", removed)
 
 
 def main():
     # optimisation(16, 1000, CONSTANT_VALUES)
     seed = int(input("Please type a seed: "))
     simulation = Simulation(CONSTANT_VALUES, seed, False)
+    if os.path.exists(simulation.checkpoint_path) and \
+            input("There is an unfinished run of seed {}, carry it on? (y/n): ".format(seed)).strip().lower() == "y":
+        simulation = Simulation.resume(simulation.checkpoint_path, configuration=simulation.configuration())
     simulation.run()
 
 
+def create_force_engine(name):
+    """returns the force engine with the name, either direct, barnes_hut, neighbour_list or parallel"""
+    if name == "barnes_hut":
+        return BarnesHut(OPENING_ANGLE)
+    if name == "neighbour_list":
+        return NeighbourList(NEIGHBOUR_SKIN)
+    if name == "parallel":
+        return ParallelDirect(FORCE_WORKERS)
+    return cal.calculate_accelerations
+
+
+def create_integrator(name):
+    """returns the integrator with the name, either euler, leapfrog, yoshida or block"""
+    if name == "leapfrog":
+        return Leapfrog()
+    if name == "yoshida":
+        return Yoshida()
+    if name == "block":
+        return BlockLeapfrog()
+    return Euler()
+
+
+def create_recording_policy(number_of_simulations):
+    """keeps the samples that stray more than RECORDING_TOLERANCE from a straight line if it is set,
+    otherwise a stride that stores about RECORDING_POINTS steps of the whole run"""
+    if RECORDING_TOLERANCE is not None:
+        return Adaptive(RECORDING_TOLERANCE)
+    return Stride(max(1, number_of_simulations // RECORDING_POINTS))
+
+
 def convert(composition, mass):
     return {composition.name: (composition.density, mass)}
 
 
-def clean_list(planetessimals, constant_values):
-    """returns the array with all objects that have mass 0 or have a distance larger than 10*that of the initial size"""
-    objects_removed = 0
-    for space_object in planetessimals:
-        distance = cal.calculate_distance(space_object.displacement_vector, np.array([0, 0, 0]))
-        if space_object.mass == 0 or DISPLACEMENT_CONSTRAINTS * constant_values.maximum_distance < distance:
-            planetessimals.remove(space_object)
-            if DISPLACEMENT_CONSTRAINTS * constant_values.maximum_distance < distance:
-                objects_removed += 1
-    return objects_removed
+def clean_list(particles, constant_values):
+    """removes all objects that have mass 0 or have a distance larger than 10*that of the initial size in one pass
+    and returns how many were removed for being too far"""
+    distance = np.sqrt((particles.displacements ** 2).sum(axis=1))
+    too_far = DISPLACEMENT_CONSTRAINTS * constant_values.maximum_distance < distance
+    keep = (particles.masses != 0) & ~too_far
+    if not keep.all():
+        particles.compact(keep)
+    return int(np.count_nonzero(too_far))
 
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Verlet neighbour list force engine
+Pairs further apart than the gravitational cutoff are never pulled together, so every pair within the
+cutoff plus a skin is listed once and the list is reused until some particle has used up half the skin,
+by moving or by its cutoff or radius growing as it gains mass.
+"""
+import numpy as np
+import calculations as cal
+
+SKIN = 20.0
+
+
+class NeighbourList:
+    """force engine that only evaluates the listed pairs, the list is rebuilt when the distance a particle moved
+    plus how much its cutoff or radius grew since the last build is more than half the skin, or when particles
+    are removed"""
+    def __init__(self, skin=SKIN, tile_size=cal.TILE_SIZE):
+        self.skin = skin
+        self.tile_size = tile_size
+        self.pairs = None
+        self.reference = None
+        self.reach = None
+        self.radii = None
+        self.rebuilds = 0
+
+    def __call__(self, displacements, masses, radii, gravitational_distance, gravitational_constant, counters=None,
+                 diagnostics=None):
+        if self.needs_rebuild(displacements, masses, radii, gravitational_distance):
+            self.build(displacements, masses, radii, gravitational_distance)
+        first, second = self.pairs[:, 0], self.pairs[:, 1]
+        direction = displacements[second] - displacements[first]
+        distance = np.sqrt((direction ** 2).sum(axis=1))
+        overlap = distance <= radii[first] + radii[second]
+        within = ~overlap & ((distance < gravitational_distance * np.sqrt(masses[second])) |
+                             (distance < gravitational_distance * np.sqrt(masses[first])))
+        cal.count_pairs(counters, None, within)
+        pull = direction[within] * (gravitational_constant / distance[within] ** 3)[:, None]
+        if diagnostics is not None:
+            diagnostics["potential_energy"] -= float((gravitational_constant * masses[first[within]] *
+                                                      masses[second[within]] / distance[within]).sum())
+        accelerations = np.zeros_like(displacements)
+        cal.add_rows(accelerations, first[within], pull * masses[second[within]][:, None])
+        cal.add_rows(accelerations, second[within], -pull * masses[first[within]][:, None])
+        return accelerations, self.pairs[overlap]
+
+    def target_accelerations(self, displacements, masses, radii, targets, gravitational_distance,
+                             gravitational_constant, counters=None):
+        """returns the accelerations of only the target slots from the listed pairs they are in, for block
+        timesteps, the list is rebuilt first if it could be missing a pair"""
+        if self.needs_rebuild(displacements, masses, radii, gravitational_distance):
+            self.build(displacements, masses, radii, gravitational_distance)
+        position = np.full(len(masses), len(targets), dtype=np.int64)
+        position[targets] = np.arange(len(targets))
+        pairs = self.pairs[(position[self.pairs[:, 0]] < len(targets)) | (position[self.pairs[:, 1]] < len(targets))]
+        first, second = pairs[:, 0], pairs[:, 1]
+        direction = displacements[second] - displacements[first]
+        distance = np.sqrt((direction ** 2).sum(axis=1))
+        overlap = distance <= radii[first] + radii[second]
+        within = ~overlap & ((distance < gravitational_distance * np.sqrt(masses[second])) |
+                             (distance < gravitational_distance * np.sqrt(masses[first])))
+        cal.count_pairs(counters, None, within)
+        first, second = first[within], second[within]
+        pull = direction[within] * (gravitational_constant / distance[within] ** 3)[:, None]
+        accelerations = np.zeros((len(targets) + 1, 3))
+        # the last row collects the pull on the partners that aren't targets
+        cal.add_rows(accelerations, position[first], pull * masses[second][:, None])
+        cal.add_rows(accelerations, position[second], -pull * masses[first][:, None])
+        return accelerations[:-1]
+
+    def needs_rebuild(self, displacements, masses, radii, gravitational_distance):
+        """checks whether a listed pair could be missing, a shift shared by every particle like the recentring
+        doesn't change any distance so it is taken out first.
+        A pair that wasn't listed was at least the larger of the cutoffs and the sum of the radii plus the skin
+        apart, so it can't be needed while no particle has moved and grown by more than half the skin"""
+        if self.pairs is None or len(masses) != len(self.reach):
+            return True
+        moved = displacements - self.reference
+        moved -= moved.mean(axis=0)
+        growth = np.maximum(np.maximum(gravitational_distance * np.sqrt(masses) - self.reach, radii - self.radii), 0)
+        return (np.sqrt((moved ** 2).sum(axis=1)) + growth).max() > self.skin / 2
+
+    def build(self, displacements, masses, radii, gravitational_distance):
+        """lists every pair (i, m) with i < m closer than the larger of their cutoffs and their radii plus the skin"""
+        number = len(masses)
+        reach = gravitational_distance * np.sqrt(masses)
+        rows = []
+        columns = []
+        for i in range(0, number, self.tile_size):
+            i_end = min(i + self.tile_size, number)
+            for m in range(i, number, self.tile_size):
+                m_end = min(m + self.tile_size, number)
+                direction = displacements[None, m:m_end] - displacements[i:i_end, None]
+                distance = np.sqrt((direction ** 2).sum(axis=-1))
+                limit = np.maximum(np.maximum(reach[i:i_end, None], reach[None, m:m_end]),
+                                   radii[i:i_end, None] + radii[None, m:m_end]) + self.skin
+                cal.add_tile_pairs(distance < limit, i, m, rows, columns)
+        self.pairs = cal.join_pairs(rows, columns)
+        self.reference = displacements.copy()
+        self.reach = reach
+        self.radii = radii.copy()
+        self.rebuilds += 1
@@ -3,11 +3,13 @@ File that stores all of the classes
 Joseph Kent
 30/04/2020
 """
+from collections.abc import MutableMapping
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
 from calculations import sphere_volume
 
+TABLE_SPACING = 0.25
+DEPLETION_BIN = 10
+
 
 class Planetessimal:
     def __init__(self, id_1, mass, displacement_vector, velocity_vector, composition):
@@ -71,6 +73,199 @@ class Planetessimal:
         self.radius = (volume * 3 / (4 * np.pi)) ** (1 / 3)
 
 
+class SpeciesTable:
+    """gives every chemical a column of the composition matrix, chemical_properties maps the names to
+    (density, probability) like COMPOSITION_CLOUD"""
+    def __init__(self, chemical_properties):
+        self.names = list(chemical_properties.keys())
+        self.columns = {name: column for column, name in enumerate(self.names)}
+        self.densities = np.array([chemical_properties[name][0] for name in self.names], dtype=float)
+
+    def __len__(self):
+        return len(self.names)
+
+    def matrix(self, compositions):
+        """returns the (N, K) matrix of a list of composition dictionaries"""
+        matrix = np.zeros((len(compositions), len(self.names)))
+        for row, composition in enumerate(compositions):
+            for key, value in composition.items():
+                matrix[row, self.columns[key]] = value
+        return matrix
+
+    def dictionary(self, row):
+        """returns the chemicals of one row that are present as a dictionary"""
+        return {name: float(row[column]) for column, name in enumerate(self.names) if row[column]}
+
+    def radii(self, compositions):
+        """returns the radius of spheres with the compositions of every row"""
+        volume = (compositions / self.densities).sum(axis=1)
+        return (volume * 3 / (4 * np.pi)) ** (1 / 3)
+
+
+class ParticleSystem:
+    """stores every particle as contiguous arrays so each step is one operation over all of them,
+    the compositions are an (N, K) matrix with the columns of the species table"""
+    def __init__(self, ids, masses, radii, displacements, velocities, compositions, species):
+        self.ids = np.array(ids, dtype=np.int64)
+        self.masses = np.array(masses, dtype=float)
+        self.radii = np.array(radii, dtype=float)
+        self.displacements = np.array(displacements, dtype=float).reshape(-1, 3)
+        self.velocities = np.array(velocities, dtype=float).reshape(-1, 3)
+        self.accelerations = np.zeros_like(self.displacements)
+        self.species = species
+        if len(compositions) and isinstance(compositions[0], dict):
+            compositions = species.matrix(compositions)
+        self.compositions = np.array(compositions, dtype=float).reshape(-1, len(species))
+        self.slots = np.full(self.ids.max() + 1 if len(self.ids) else 0, -1, dtype=np.int64)
+        self.slots[self.ids] = np.arange(len(self.ids))
+
+    @classmethod
+    def from_planetessimals(cls, planetessimals, species):
+        """builds the arrays from a list of planetessimals"""
+        return cls([space_object.id for space_object in planetessimals],
+                   [space_object.mass for space_object in planetessimals],
+                   [space_object.radius for space_object in planetessimals],
+                   [space_object.displacement_vector for space_object in planetessimals],
+                   [space_object.velocity_vector for space_object in planetessimals],
+                   [dict(space_object.composition) for space_object in planetessimals], species)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, slot):
+        return ParticleView(self, slot)
+
+    def __iter__(self):
+        for slot in range(len(self)):
+            yield ParticleView(self, slot)
+
+    def calculate_displacements(self):
+        """calculates the displacement and velocity vectors of every particle"""
+        self.velocities += self.accelerations
+        self.displacements += self.velocities
+
+    def shift_center(self, new_center):
+        """shifts every particle by an amount"""
+        self.displacements -= new_center
+
+    def set_acceleration_to_zero(self):
+        """sets every acceleration to zero"""
+        self.accelerations[:] = 0.0
+
+    def momentum(self):
+        """returns the momentum of every particle"""
+        return self.masses[:, None] * self.velocities
+
+    def compact(self, keep):
+        """keeps only the particles where keep is true, in one pass over every array"""
+        self.ids = self.ids[keep]
+        self.masses = self.masses[keep]
+        self.radii = self.radii[keep]
+        self.displacements = self.displacements[keep]
+        self.velocities = self.velocities[keep]
+        self.accelerations = self.accelerations[keep]
+        self.compositions = self.compositions[keep]
+        self.slots[:] = -1
+        self.slots[self.ids] = np.arange(len(self.ids))
+
+    def species_totals(self):
+        """returns the total mass of every chemical"""
+        return dict(zip(self.species.names, self.compositions.sum(axis=0).tolist()))
+
+    def slot(self, id_value):
+        """returns the slot of the particle with the id or -1 if it has been removed"""
+        return int(self.slots[id_value]) if 0 <= id_value < len(self.slots) else -1
+
+
+class ParticleView(Planetessimal):
+    """a planetessimal that reads and writes one slot of a particle system"""
+    def __init__(self, system, slot):
+        self.system = system
+        self.slot = slot
+
+    @property
+    def id(self):
+        return int(self.system.ids[self.slot])
+
+    @property
+    def mass(self):
+        return self.system.masses[self.slot]
+
+    @mass.setter
+    def mass(self, value):
+        self.system.masses[self.slot] = value
+
+    @property
+    def radius(self):
+        return self.system.radii[self.slot]
+
+    @radius.setter
+    def radius(self, value):
+        self.system.radii[self.slot] = value
+
+    @property
+    def displacement_vector(self):
+        return self.system.displacements[self.slot]
+
+    @displacement_vector.setter
+    def displacement_vector(self, value):
+        self.system.displacements[self.slot] = value
+
+    @property
+    def velocity_vector(self):
+        return self.system.velocities[self.slot]
+
+    @velocity_vector.setter
+    def velocity_vector(self, value):
+        self.system.velocities[self.slot] = value
+
+    @property
+    def acceleration(self):
+        return self.system.accelerations[self.slot]
+
+    @acceleration.setter
+    def acceleration(self, value):
+        self.system.accelerations[self.slot] = value
+
+    @property
+    def composition(self):
+        """the row of the composition matrix as a dictionary that writes through to the matrix"""
+        return CompositionRow(self.system.species, self.system.compositions[self.slot])
+
+    @composition.setter
+    def composition(self, value):
+        self.system.compositions[self.slot] = 0
+        self.composition.update(value)
+
+
+class CompositionRow(MutableMapping):
+    """the chemicals of one row of a composition matrix that are present, setting a chemical writes the matrix"""
+    def __init__(self, species, row):
+        self.species = species
+        self.row = row
+
+    def __getitem__(self, key):
+        if key not in self.species.columns or not self.row[self.species.columns[key]]:
+            raise KeyError(key)
+        return float(self.row[self.species.columns[key]])
+
+    def __setitem__(self, key, value):
+        self.row[self.species.columns[key]] = value
+
+    def __delitem__(self, key):
+        self[key]
+        self.row[self.species.columns[key]] = 0
+
+    def __iter__(self):
+        return iter(self.species.dictionary(self.row))
+
+    def __len__(self):
+        return len(self.species.dictionary(self.row))
+
+    def __repr__(self):
+        return repr(self.species.dictionary(self.row))
+
+
 class DensityCurve:
     def __init__(self, resource, amount, minimum, maximum, threshold):
         self.resource = resource
@@ -80,6 +275,13 @@ class DensityCurve:
         self.threshold = threshold
         self.points = {}
 
+    def profile(self, distances):
+        """returns the density of the curve at every distance, the same shape as get_density without the
+        depletion and without overflowing far from the edges"""
+        first_half = 1 / (1 + np.exp(np.clip(self.minimum - distances, -700, 700)))
+        second_half = 1 / (1 + np.exp(np.clip(self.maximum - distances, -700, 700)))
+        return first_half - second_half
+
     def get_density(self, distance, mass):
         if mass > self.threshold:
             first_half = np.e ** (-self.minimum + distance)
@@ -92,6 +294,32 @@ class DensityCurve:
             return self.resource, 0
 
 
+class DensityTable:
+    """the density curves sampled every spacing out to maximum_distance so a body only needs an interpolation,
+    the depletion of every curve is kept in a fixed array of bins bin_width wide"""
+    def __init__(self, density_regions, species, maximum_distance, spacing=TABLE_SPACING, bin_width=DEPLETION_BIN):
+        self.distances = np.arange(0, maximum_distance + spacing, spacing)
+        self.profiles = np.array([curve.profile(self.distances) for curve in density_regions])
+        self.amounts = np.array([curve.amount for curve in density_regions], dtype=float)
+        self.thresholds = np.array([curve.threshold for curve in density_regions], dtype=float)
+        self.columns = [species.columns[curve.resource] for curve in density_regions]
+        self.bin_width = bin_width
+        self.depletion = np.zeros((len(density_regions), int(maximum_distance // bin_width) + 1))
+
+    def accrete(self, distances, masses):
+        """returns the (curves, N) amount every body takes from every curve and adds it to the depletion,
+        bodies in the same bin all see the depletion from before the call"""
+        bins = np.minimum((distances // self.bin_width).astype(np.int64), self.depletion.shape[1] - 1)
+        amounts = np.zeros((len(self.amounts), len(distances)))
+        for curve in range(len(self.amounts)):
+            eligible = masses > self.thresholds[curve]
+            profile = np.interp(distances[eligible], self.distances, self.profiles[curve])
+            amount = self.amounts[curve] * profile * (self.amounts[curve] - self.depletion[curve, bins[eligible]])
+            self.depletion[curve] += np.bincount(bins[eligible], weights=amount, minlength=self.depletion.shape[1])
+            amounts[curve, eligible] = np.where(amount > 10 ** -100, amount, 0.0)
+        return amounts
+
+
 class OptimisableValues:
     def __init__(self, gravity, acceleration_error, spin, maximum_distance, simulations_before_calculation):
         self.gravity = gravity
@@ -100,11 +328,18 @@ class OptimisableValues:
         self.maximum_distance = maximum_distance
         self.simulations_before_calculation = simulations_before_calculation
 
-    def return_variation(self):
-        weights = np.random.uniform(0.6, 1.4, 5)
-        return OptimisableValues(self.gravity * weights[0], round(self.acceleration_error * weights[1] + 1),
+    def return_variation(self, random=np.random):
+        """returns a copy with every value scaled by a random weight from 0.6 to 1.4, the simulations before
+        calculation stay a whole number of at least 1, random can be a numpy Generator"""
+        weights = random.uniform(0.6, 1.4, 5)
+        return OptimisableValues(self.gravity * weights[0], self.acceleration_error * weights[1],
                                  self.spin * weights[2], self.maximum_distance * weights[3],
-                                 self.simulations_before_calculation * weights[4])
+                                 max(1, round(self.simulations_before_calculation * weights[4])))
+
+    def __repr__(self):
+        return "OptimisableValues({}, {}, {}, {}, {})".format(self.gravity, self.acceleration_error, self.spin,
+                                                             self.maximum_distance,
+                                                             self.simulations_before_calculation)
 
 
 class Paths:
@@ -113,12 +348,13 @@ class Paths:
         for id_value in id_list:
             self.dictionary_of_paths[id_value] = Path()
 
-    def display(self, filename, storage_address):
-        """shows an image of all of the objects paths"""
+    def display(self, filename, storage_address, maximum_points=None):
+        """shows an image of all of the objects paths, every path is thinned to at most maximum_points points"""
+        import matplotlib.pyplot as plt
         ax = plt.axes(projection='3d')
         ax.grid(False)
         for path in list(self.dictionary_of_paths.values()):
-            x, y, z, radius = path.get_lists()
+            x, y, z, radius = path.get_lists(maximum_points)
             ax.scatter3D(x, y, z,
                          s=radius)
         # plt.savefig(storage_address + filename + ".png")
@@ -143,8 +379,12 @@ class Path:
         self.z.append(z)
         self.radius.append(radius)
 
-    def get_lists(self):
-        return self.x, self.y, self.z, self.radius
+    def get_lists(self, maximum_points=None):
+        if maximum_points is None or len(self.x) <= maximum_points:
+            return self.x, self.y, self.z, self.radius
+        keep = np.unique(np.linspace(0, len(self.x) - 1, maximum_points).round().astype(int))
+        return ([self.x[i] for i in keep], [self.y[i] for i in keep], [self.z[i] for i in keep],
+                [self.radius[i] for i in keep])
 
 
 class InnerPlanet:
@@ -175,6 +415,7 @@ class Chemicals:
 
     def display(self):
         """displays a graph of the state of matter"""
+        import matplotlib.pyplot as plt
         x = np.array(range(0, self.triple_point[0]+1))
         y = eval("({}*x**2)/({}**2)".format(self.triple_point[1],self.triple_point[0]))
         plt.plot(x, y)
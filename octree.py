@@ -0,0 +1,250 @@
+"""
+Barnes-Hut octree force engine
+Groups of particles that are far enough away are replaced by their centre of mass (and optionally
+their quadrupole moment) so a step costs about N log N instead of N squared.
+There is a list bellow
+Octree
+BarnesHut
+"""
+import numpy as np
+import calculations as cal
+from spatial_hash import SpatialHash
+
+OPENING_ANGLE = 0.5
+LEAF_SIZE = 8
+MAXIMUM_DEPTH = 16
+BATCH_SIZE = 4096
+
+
+class Octree:
+    """an octree over the particles with the moments of every node, the particles are sorted along a
+    morton curve so every node holds a contiguous range [start, stop) of the sorted order"""
+    def __init__(self, displacements, masses, radii, leaf_size=LEAF_SIZE, quadrupole=False):
+        self.displacements = displacements
+        self.masses = masses
+        self.radii = radii
+        self.quadrupole = quadrupole
+        self.counters = None
+        self.diagnostics = None
+        codes = morton_codes(displacements)
+        self.order = np.argsort(codes, kind="stable")
+        self.rank = np.empty_like(self.order)
+        self.rank[self.order] = np.arange(len(self.order))
+        self.build(codes[self.order], leaf_size)
+
+    def build(self, codes, leaf_size):
+        """creates the nodes level by level, splitting every node with more than leaf_size particles"""
+        number = len(codes)
+        starts = np.array([0])
+        stops = np.array([number])
+        levels = [(starts, stops)]
+        first_child = []
+        for level in range(1, MAXIMUM_DEPTH + 1):
+            split = stops - starts > leaf_size
+            if not split.any():
+                break
+            prefix = codes >> np.uint64(3 * (MAXIMUM_DEPTH - level))
+            segment_starts = np.concatenate([[0], np.flatnonzero(np.diff(prefix)) + 1])
+            parents = np.searchsorted(starts, segment_starts, side="right") - 1
+            keep = (parents >= 0) & (segment_starts < stops[np.maximum(parents, 0)]) & split[np.maximum(parents, 0)]
+            segment_stops = np.concatenate([segment_starts[1:], [number]])
+            starts, stops, parents = segment_starts[keep], segment_stops[keep], parents[keep]
+            child_counts = np.bincount(parents, minlength=len(split))
+            offset = sum(len(level_starts) for level_starts, level_stops in levels)
+            first_child.append((offset + np.cumsum(child_counts) - child_counts, child_counts))
+            levels.append((starts, stops))
+        first_child.append((np.zeros(len(levels[-1][0]), dtype=np.int64), np.zeros(len(levels[-1][0]), dtype=np.int64)))
+        self.level_offsets = np.cumsum([0] + [len(level_starts) for level_starts, level_stops in levels])
+        self.start = np.concatenate([level_starts for level_starts, level_stops in levels])
+        self.stop = np.concatenate([level_stops for level_starts, level_stops in levels])
+        self.first_child = np.concatenate([children[0] for children in first_child]).astype(np.int64)
+        self.child_count = np.concatenate([children[1] for children in first_child]).astype(np.int64)
+        self.calculate_moments()
+
+    def calculate_moments(self):
+        """calculates the mass, centre of mass, bounds and optionally the quadrupole of every node"""
+        sorted_displacements = self.displacements[self.order]
+        sorted_masses = self.masses[self.order]
+        self.mass = segment_sum(sorted_masses, self.start, self.stop)
+        weighted = segment_sum(sorted_displacements * sorted_masses[:, None], self.start, self.stop)
+        self.lower = self.reduce_levels(np.minimum, sorted_displacements)
+        self.upper = self.reduce_levels(np.maximum, sorted_displacements)
+        middle = (self.lower + self.upper) / 2
+        self.center = np.where(self.mass[:, None] > 0, weighted / np.where(self.mass > 0, self.mass, 1.0)[:, None],
+                               middle)
+        self.size = (self.upper - self.lower).max(axis=1)
+        self.minimum_mass = self.reduce_levels(np.minimum, sorted_masses)
+        self.maximum_mass = self.reduce_levels(np.maximum, sorted_masses)
+        self.maximum_radius = self.reduce_levels(np.maximum, self.radii[self.order])
+        self.moment = None
+        if self.quadrupole:
+            node_of_particle, particle = expand(np.arange(len(self.start)), self.start, self.stop - self.start)
+            offset = sorted_displacements[particle] - self.center[node_of_particle]
+            outer = 3 * offset[:, :, None] * offset[:, None, :] - (offset ** 2).sum(axis=1)[:, None, None] * np.eye(3)
+            moment = np.zeros((len(self.start), 3, 3))
+            np.add.at(moment, node_of_particle, outer * sorted_masses[particle][:, None, None])
+            self.moment = moment
+
+    def reduce_levels(self, function, values):
+        """reduces the sorted values over every node, one level of the tree at a time"""
+        result = np.empty((len(self.start),) + values.shape[1:])
+        for first, last in zip(self.level_offsets[:-1], self.level_offsets[1:]):
+            result[first:last] = segment_reduce(function, values, self.start[first:last], self.stop[first:last])
+        return result
+
+    def accelerations(self, gravitational_distance, gravitational_constant, opening_angle=OPENING_ANGLE,
+                      counters=None, diagnostics=None, targets=None):
+        """returns the acceleration of every particle, or of only the target slots if they are given,
+        pairs that clip each other are left out like the direct sum,
+        if counters is given the particle pairs and whole nodes that were evaluated are added to it,
+        if diagnostics is given the potential energy from the same pairs and nodes is added to it"""
+        self.counters = counters
+        self.diagnostics = diagnostics
+        number = len(self.masses)
+        bodies = np.arange(number) if targets is None else np.asarray(targets, dtype=np.int64)
+        accelerations = np.zeros((number, 3))
+        for batch_start in range(0, len(bodies), BATCH_SIZE):
+            self.walk(bodies[batch_start:batch_start + BATCH_SIZE], accelerations, gravitational_distance,
+                      gravitational_constant, opening_angle)
+        return accelerations if targets is None else accelerations[bodies]
+
+    def walk(self, bodies, accelerations, gravitational_distance, gravitational_constant, opening_angle):
+        """walks every body down the tree together, one level of nodes at a time"""
+        nodes = np.zeros(len(bodies), dtype=np.int64)
+        while len(bodies):
+            displacements = self.displacements[bodies]
+            masses = self.masses[bodies]
+            offset = displacements - self.center[nodes]
+            distance = np.sqrt((offset ** 2).sum(axis=1))
+            inside = (self.start[nodes] <= self.rank[bodies]) & (self.rank[bodies] < self.stop[nodes])
+            nearest = np.sqrt((np.maximum(0, np.maximum(self.lower[nodes] - displacements,
+                                                        displacements - self.upper[nodes])) ** 2).sum(axis=1))
+            furthest = np.sqrt((np.maximum(np.abs(displacements - self.lower[nodes]),
+                                           np.abs(displacements - self.upper[nodes])) ** 2).sum(axis=1))
+            out_of_reach = ~inside & (nearest >= gravitational_distance * np.sqrt(
+                np.maximum(masses, self.maximum_mass[nodes])))
+            in_reach = furthest < gravitational_distance * np.sqrt(np.maximum(masses, self.minimum_mass[nodes]))
+            clear = nearest > self.radii[bodies] + self.maximum_radius[nodes]
+            accept = ~inside & ~out_of_reach & in_reach & clear & (self.size[nodes] < opening_angle * distance)
+            self.add_node_accelerations(accelerations, bodies[accept], nodes[accept], offset[accept],
+                                        distance[accept], gravitational_constant)
+            if self.counters is not None:
+                self.counters["nodes_evaluated"] += int(np.count_nonzero(accept))
+            open_nodes = ~out_of_reach & ~accept
+            leaf = open_nodes & (self.child_count[nodes] == 0)
+            self.add_leaf_accelerations(accelerations, bodies[leaf], nodes[leaf], gravitational_distance,
+                                        gravitational_constant)
+            branch = open_nodes & ~leaf
+            bodies, nodes = expand(bodies[branch], self.first_child[nodes[branch]], self.child_count[nodes[branch]])
+
+    def add_node_accelerations(self, accelerations, bodies, nodes, offset, distance, gravitational_constant):
+        """adds the pull of whole nodes using their monopole and quadrupole moments"""
+        pull = -gravitational_constant * self.mass[nodes][:, None] * offset / distance[:, None] ** 3
+        potential = -gravitational_constant * self.mass[nodes] / distance
+        if self.moment is not None:
+            moment_offset = np.einsum("nij,nj->ni", self.moment[nodes], offset)
+            projection = (offset * moment_offset).sum(axis=1)
+            pull += gravitational_constant * (moment_offset / distance[:, None] ** 5 -
+                                              2.5 * projection[:, None] * offset / distance[:, None] ** 7)
+            potential -= 0.5 * gravitational_constant * projection / distance ** 5
+        if self.diagnostics is not None:
+            self.diagnostics["potential_energy"] += 0.5 * float(self.masses[bodies] @ potential)
+        cal.add_rows(accelerations, bodies, pull)
+
+    def add_leaf_accelerations(self, accelerations, bodies, nodes, gravitational_distance, gravitational_constant):
+        """adds the pull of every particle in a leaf, with the same rules as the direct sum"""
+        bodies, ranks = expand(bodies, self.start[nodes], self.stop[nodes] - self.start[nodes])
+        sources = self.order[ranks]
+        different = sources != bodies
+        bodies, sources = bodies[different], sources[different]
+        direction = self.displacements[sources] - self.displacements[bodies]
+        distance = np.sqrt((direction ** 2).sum(axis=1))
+        overlap = distance <= self.radii[bodies] + self.radii[sources]
+        within = ~overlap & ((distance < gravitational_distance * np.sqrt(self.masses[sources])) |
+                             (distance < gravitational_distance * np.sqrt(self.masses[bodies])))
+        cal.count_pairs(self.counters, None, within, 0.5)
+        bodies, sources, direction, distance = bodies[within], sources[within], direction[within], distance[within]
+        if self.diagnostics is not None:
+            self.diagnostics["potential_energy"] -= 0.5 * float((gravitational_constant * self.masses[bodies] *
+                                                                 self.masses[sources] / distance).sum())
+        cal.add_rows(accelerations, bodies,
+                 direction * (gravitational_constant * self.masses[sources] / distance ** 3)[:, None])
+
+
+class BarnesHut:
+    """force engine that rebuilds an octree every step, the opening angle trades accuracy for speed,
+    clipping pairs are found with a spatial hash"""
+    def __init__(self, opening_angle=OPENING_ANGLE, quadrupole=False, leaf_size=LEAF_SIZE):
+        self.opening_angle = opening_angle
+        self.quadrupole = quadrupole
+        self.leaf_size = leaf_size
+        self.spatial_hash = SpatialHash()
+
+    def __call__(self, displacements, masses, radii, gravitational_distance, gravitational_constant, counters=None,
+                 diagnostics=None):
+        tree = Octree(displacements, masses, radii, self.leaf_size, self.quadrupole)
+        accelerations = tree.accelerations(gravitational_distance, gravitational_constant, self.opening_angle,
+                                           counters, diagnostics)
+        return accelerations, self.spatial_hash.clipping_pairs(displacements, radii)
+
+    def target_accelerations(self, displacements, masses, radii, targets, gravitational_distance,
+                             gravitational_constant, counters=None):
+        """returns the accelerations of only the target slots from a tree of every particle, for block timesteps"""
+        tree = Octree(displacements, masses, radii, self.leaf_size, self.quadrupole)
+        return tree.accelerations(gravitational_distance, gravitational_constant, self.opening_angle, counters,
+                                  targets=targets)
+
+    def force_error(self, displacements, masses, radii, gravitational_distance, gravitational_constant,
+                    sample_size=None):
+        """returns the mean and maximum error of the accelerations against the direct sum relative to the root mean
+        square of the exact accelerations, so bodies whose forces nearly cancel don't blow it up,
+        only the first sample_size particles are checked if it is given"""
+        approximate, _ = self(displacements, masses, radii, gravitational_distance, gravitational_constant)
+        stop = len(masses) if sample_size is None else min(sample_size, len(masses))
+        exact, _ = cal.calculate_accelerations(displacements, masses, radii, gravitational_distance,
+                                               gravitational_constant, stop=stop)
+        scale = np.sqrt((exact ** 2).sum(axis=1).mean()) if stop else 0.0
+        error = np.sqrt(((approximate[:stop] - exact) ** 2).sum(axis=1)) / (scale if scale > 0 else 1.0)
+        return error.mean(), error.max()
+
+
+def expand(bodies, first, counts):
+    """repeats every body once for each of the count items starting at first"""
+    repeated = np.repeat(bodies, counts)
+    steps = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return repeated, np.repeat(first, counts) + steps
+
+
+def segment_sum(values, starts, stops):
+    """sums the values in every [start, stop) range"""
+    total = np.concatenate([np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0)])
+    return total[stops] - total[starts]
+
+
+def segment_reduce(function, values, starts, stops):
+    """reduces the values in every [start, stop) range, the ranges must be sorted, non empty and not overlap"""
+    padded = np.concatenate([values, values[-1:]])
+    boundaries = np.stack([starts, stops], axis=1).ravel()
+    return function.reduceat(padded, boundaries, axis=0)[::2]
+
+
+def morton_codes(displacements):
+    """returns the morton code of every particle on a grid of 2 ** MAXIMUM_DEPTH cells a side"""
+    lower = displacements.min(axis=0)
+    size = (displacements.max(axis=0) - lower).max()
+    size = size if size > 0 else 1.0
+    cells = 2 ** MAXIMUM_DEPTH
+    grid = np.clip(((displacements - lower) / size * cells).astype(np.int64), 0, cells - 1).astype(np.uint64)
+    return (spread_bits(grid[:, 0]) << np.uint64(2)) | (spread_bits(grid[:, 1]) << np.uint64(1)) | spread_bits(
+        grid[:, 2])
+
+
+def spread_bits(values):
+    """puts two zero bits between every bit of a 21 bit number"""
+    values = values & np.uint64(0x1fffff)
+    values = (values | values << np.uint64(32)) & np.uint64(0x1f00000000ffff)
+    values = (values | values << np.uint64(16)) & np.uint64(0x1f0000ff0000ff)
+    values = (values | values << np.uint64(8)) & np.uint64(0x100f00f00f00f00f)
+    values = (values | values << np.uint64(4)) & np.uint64(0x10c30c30c30c30c3)
+    values = (values | values << np.uint64(2)) & np.uint64(0x1249249249249249)
+    return values
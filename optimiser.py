@@ -0,0 +1,111 @@
+"""
+Parallel optimiser for the OptimisableValues
+Every candidate of a generation is run in its own process, the best candidates survive into the next generation
+and the rest of the population is refilled with variations of them.
+All candidates of a generation use the same simulation seed so they are compared on the same initial conditions,
+the seeds and the variations come from one Generator so an optimisation can be repeated.
+A generation that runs out of time stops its workers and every candidate that didn't finish gets a fitness of 0.
+There is a list bellow
+Optimiser
+optimisation
+evaluate
+"""
+import multiprocessing
+import os
+import time
+import numpy as np
+from main import Simulation, RESULT_CACHE
+from result_cache import ResultCache
+
+WORKERS = os.cpu_count()
+SURVIVORS = 4
+
+
+def evaluate(constant_values, seed):
+    """runs one simulation and returns its fitness, a run that was already done is read from the result cache"""
+    return Simulation(constant_values, seed, cache=ResultCache(RESULT_CACHE)).run()
+
+
+class Optimiser:
+    """keeps the survivors of every generation, objective is called with the values and a seed inside the worker
+    processes and has to be a module level function"""
+    def __init__(self, constant_values, population_size, workers=WORKERS, survivors=SURVIVORS, seed=1,
+                 time_budget=None, generation_budget=None, objective=evaluate):
+        self.random = np.random.default_rng(seed)
+        self.population = [constant_values.return_variation(self.random) for pop in range(population_size)]
+        self.workers = workers
+        self.survivors = max(1, min(survivors, population_size))
+        self.time_budget = time_budget
+        self.generation_budget = generation_budget
+        self.objective = objective
+        self.best = None
+        self.best_fitness = -np.inf
+        self.history = []
+        self.pool = None
+
+    def run(self, generations):
+        """runs up to generations generations or until the time budget is used up and returns the best values"""
+        deadline = None if self.time_budget is None else time.monotonic() + self.time_budget
+        try:
+            for generation in range(generations):
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                results = self.evaluate_population(int(self.random.integers(2 ** 31)), deadline)
+                self.select(results)
+                self.history.append((generation, self.best_fitness, self.best))
+                print("simulation {} with a maximum value {}".format(generation, max(results)))
+        finally:
+            self.close()
+        return self.best
+
+    def evaluate_population(self, seed, deadline):
+        """returns the fitness of every candidate, the workers are stopped when the generation runs out of time"""
+        if self.generation_budget is not None:
+            generation_deadline = time.monotonic() + self.generation_budget
+            deadline = generation_deadline if deadline is None else min(deadline, generation_deadline)
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.workers)
+        pending = [self.pool.apply_async(self.objective, (values, seed)) for values in self.population]
+        results = []
+        for result in pending:
+            try:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                results.append(result.get(timeout))
+            except multiprocessing.TimeoutError:
+                results.append(0.0)
+        if any(not result.ready() for result in pending):
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        return results
+
+    def select(self, results):
+        """keeps the survivors and refills the population with variations of randomly picked survivors"""
+        order = np.argsort(results)[::-1]
+        if results[order[0]] > self.best_fitness:
+            self.best_fitness = results[order[0]]
+            self.best = self.population[order[0]]
+        parents = [self.population[index] for index in order[:self.survivors]]
+        children = [parents[self.random.integers(len(parents))].return_variation(self.random)
+                    for pop in range(len(self.population) - len(parents))]
+        self.population = parents + children
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+def optimisation(pop_size, optimisation_number, constant_values, workers=WORKERS, time_budget=None,
+                 generation_budget=None, seed=1, objective=evaluate):
+    """an optimisation algorithm that optimises for the best program performance"""
+    optimiser = Optimiser(constant_values, pop_size, workers, SURVIVORS, seed, time_budget, generation_budget,
+                          objective)
+    best = optimiser.run(optimisation_number)
+    if best is not None:
+        print("The best simulation had gravity {}, spin {}, maximum distance {}, acceleration error {}, "
+              "simulations before calculation {}".format(best.gravity, best.spin, best.maximum_distance,
+                                                         best.acceleration_error,
+                                                         best.simulations_before_calculation))
+    return best
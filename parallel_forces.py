@@ -0,0 +1,112 @@
+"""
+Multi-core direct sum force engine
+The displacements, masses and radii live in shared memory so every step only the row ranges are sent to the
+worker processes, every worker writes the accelerations of its own rows straight back into shared memory.
+"""
+import os
+import numpy as np
+from multiprocessing import Pool, shared_memory
+import calculations as cal
+
+WORKERS = os.cpu_count()
+SERIAL_LIMIT = 512
+COLUMNS = 8
+
+attached = {}
+
+
+class ParallelDirect:
+    """force engine that splits the rows of the direct sum between processes, rows are split on tile boundaries
+    so the result is bit for bit the same as calculations.calculate_accelerations for any number of workers"""
+    def __init__(self, workers=WORKERS, serial_limit=SERIAL_LIMIT, tile_size=cal.TILE_SIZE):
+        self.workers = workers
+        self.serial_limit = serial_limit
+        self.tile_size = tile_size
+        self.pool = None
+        self.memory = None
+        self.capacity = 0
+
+    def __call__(self, displacements, masses, radii, gravitational_distance, gravitational_constant, counters=None,
+                 diagnostics=None):
+        number = len(masses)
+        if number < self.serial_limit or self.workers < 2:
+            return cal.calculate_accelerations(displacements, masses, radii, gravitational_distance,
+                                               gravitational_constant, self.tile_size, counters=counters,
+                                               diagnostics=diagnostics)
+        arrays = self.share(number)
+        arrays[:number, 0:3] = displacements
+        arrays[:number, 3] = masses
+        arrays[:number, 4] = radii
+        tasks = [(self.memory.name, self.capacity, number, start, stop, gravitational_distance,
+                  gravitational_constant, self.tile_size, counters is not None, diagnostics is not None)
+                 for start, stop in self.chunks(number)]
+        results = self.pool.starmap(worker_accelerations, tasks)
+        for worker_pairs, worker_counters, worker_diagnostics in results:
+            if counters is not None:
+                for name, value in worker_counters.items():
+                    counters[name] += value
+            if diagnostics is not None:
+                diagnostics["potential_energy"] += worker_diagnostics["potential_energy"]
+        pairs = [result[0] for result in results]
+        pairs = np.concatenate(pairs) if pairs else np.zeros((0, 2), dtype=np.int64)
+        return arrays[:number, 5:8].copy(), pairs
+
+    def target_accelerations(self, displacements, masses, radii, targets, gravitational_distance,
+                             gravitational_constant, counters=None):
+        """returns the accelerations of only the target slots, block timesteps only move a few particles between
+        full steps so they are calculated in this process"""
+        return cal.calculate_target_accelerations(displacements, masses, radii, targets, gravitational_distance,
+                                                  gravitational_constant, self.tile_size, counters)
+
+    def chunks(self, number):
+        """splits the rows into one range of whole tiles for every worker"""
+        tiles = np.arange(0, number, self.tile_size)
+        return [(int(group[0]), int(min(group[-1] + self.tile_size, number)))
+                for group in np.array_split(tiles, min(self.workers, len(tiles))) if len(group)]
+
+    def share(self, number):
+        """returns the shared array, it is only reallocated when the particles no longer fit, the pool is started
+        after the first allocation so the workers share the resource tracker of this process"""
+        if number > self.capacity:
+            self.release()
+            self.capacity = number
+            self.memory = shared_memory.SharedMemory(create=True, size=self.capacity * COLUMNS * 8)
+        if self.pool is None:
+            self.pool = Pool(self.workers)
+        return np.ndarray((self.capacity, COLUMNS), dtype=float, buffer=self.memory.buf)
+
+    def release(self):
+        """frees the shared memory"""
+        if self.memory is not None:
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
+            self.capacity = 0
+
+    def close(self):
+        """stops the worker processes and frees the shared memory"""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.release()
+
+
+def worker_accelerations(name, capacity, number, start, stop, gravitational_distance, gravitational_constant,
+                         tile_size, counting=False, potential=False):
+    """calculates the rows from start to stop inside a worker and returns the clipping pairs, the pair counts and
+    the potential energy of the rows"""
+    if name not in attached:
+        for memory in attached.values():
+            memory.close()
+        attached.clear()
+        attached[name] = shared_memory.SharedMemory(name=name)
+    arrays = np.ndarray((capacity, COLUMNS), dtype=float, buffer=attached[name].buf)
+    counters = {"pairs_evaluated": 0, "pairs_within": 0} if counting else None
+    diagnostics = {"potential_energy": 0.0} if potential else None
+    accelerations, pairs = cal.calculate_accelerations(arrays[:number, 0:3], arrays[:number, 3],
+                                                       arrays[:number, 4], gravitational_distance,
+                                                       gravitational_constant, tile_size, start, stop,
+                                                       counters, diagnostics)
+    arrays[start:stop, 5:8] = accelerations
+    return pairs, counters, diagnostics
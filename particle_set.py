@@ -0,0 +1,145 @@
+"""
+Binary files of whole particle sets, for initial conditions made elsewhere and for the final bodies of a run
+A file is MAGIC, the length of a json header as a little endian uint64, the header and then every column as one
+contiguous little endian block: ids, masses, radii, displacements (N, 3), velocities (N, 3) and compositions (N, K).
+The header has the number of particles, the names and densities of the composition columns, the offset of every
+column and any extra metadata, the blocks start on ALIGNMENT bytes so they can be memory mapped directly.
+The reader maps the columns lazily so a subset by id or by region only reads the columns it needs.
+There is a list bellow
+write_particle_set
+ParticleSetReader
+digest
+"""
+import hashlib
+import json
+import os
+import numpy as np
+from object_file import ParticleSystem, SpeciesTable
+
+MAGIC = b"PSET0001"
+ALIGNMENT = 64
+CHUNK_ROWS = 1 << 20
+COLUMNS = [("ids", "<i8", ()), ("masses", "<f8", ()), ("radii", "<f8", ()), ("displacements", "<f8", (3,)),
+           ("velocities", "<f8", (3,)), ("compositions", "<f8", None)]
+
+
+def write_particle_set(path, particles, metadata=None):
+    """writes a ParticleSystem, it goes to a temporary file first so a reader never sees half of one"""
+    species = len(particles.species)
+    columns = {}
+    offset = 0
+    for name, dtype, shape in COLUMNS:
+        shape = (species,) if shape is None else shape
+        columns[name] = {"dtype": dtype, "shape": list(shape), "offset": offset}
+        offset = aligned(offset + len(particles) * int(np.prod(shape)) * np.dtype(dtype).itemsize)
+    ids = particles.ids
+    header = {"count": len(particles), "species": particles.species.names,
+              "densities": particles.species.densities.tolist(), "columns": columns,
+              "sorted_ids": bool((ids[1:] > ids[:-1]).all()), "metadata": metadata or {}}
+    text = json.dumps(header).encode()
+    start = aligned(len(MAGIC) + 8 + len(text))
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + ".tmp", "wb") as file:
+        file.write(MAGIC + np.uint64(len(text)).astype("<u8").tobytes() + text)
+        for name, dtype, shape in COLUMNS:
+            file.seek(start + columns[name]["offset"])
+            np.ascontiguousarray(getattr(particles, name), dtype=dtype).tofile(file)
+        file.truncate(start + offset)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+class ParticleSetReader:
+    """maps the columns of a file written by write_particle_set, nothing is read until a column is used"""
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError("{} is not a particle set".format(path))
+            length = int(np.frombuffer(file.read(8), dtype="<u8")[0])
+            header = json.loads(file.read(length))
+        self.start = aligned(len(MAGIC) + 8 + length)
+        self.count = header["count"]
+        self.species = SpeciesTable({name: (density, 0) for name, density in zip(header["species"],
+                                                                                 header["densities"])})
+        self.columns = header["columns"]
+        self.sorted_ids = header["sorted_ids"]
+        self.metadata = header["metadata"]
+        self.maps = {}
+
+    def __len__(self):
+        return self.count
+
+    def column(self, name):
+        """returns the read only memory map of one column"""
+        if name not in self.maps:
+            column = self.columns[name]
+            self.maps[name] = np.memmap(self.path, dtype=column["dtype"], mode="r",
+                                        offset=self.start + column["offset"],
+                                        shape=(self.count,) + tuple(column["shape"])) if self.count else \
+                np.zeros((0,) + tuple(column["shape"]), dtype=column["dtype"])
+        return self.maps[name]
+
+    def slots_of_ids(self, ids):
+        """returns the slots of the ids that are in the file, a file with sorted ids is binary searched"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.sorted_ids:
+            slots = np.searchsorted(self.column("ids"), ids)
+            found = slots < self.count
+            found[found] = self.column("ids")[slots[found]] == ids[found]
+            return slots[found]
+        slots = []
+        for first in range(0, self.count, CHUNK_ROWS):
+            chunk = self.column("ids")[first:first + CHUNK_ROWS]
+            slots.append(first + np.flatnonzero(np.isin(chunk, ids)))
+        return np.concatenate(slots) if slots else np.zeros(0, dtype=np.int64)
+
+    def slots_in_region(self, lower, upper):
+        """returns the slots of the particles inside the box from lower to upper, only the displacements are read"""
+        lower = np.asarray(lower, dtype=float)
+        upper = np.asarray(upper, dtype=float)
+        slots = []
+        for first in range(0, self.count, CHUNK_ROWS):
+            chunk = self.column("displacements")[first:first + CHUNK_ROWS]
+            slots.append(first + np.flatnonzero(((chunk >= lower) & (chunk <= upper)).all(axis=1)))
+        return np.concatenate(slots) if slots else np.zeros(0, dtype=np.int64)
+
+    def particles(self, slots=None, species=None):
+        """returns a ParticleSystem of the slots, or of every particle, with the composition columns moved to the
+        columns of species if it is given"""
+        select = slice(None) if slots is None else np.asarray(slots, dtype=np.int64)
+        compositions = self.column("compositions")[select]
+        if species is None:
+            species = self.species
+        elif species.names != self.species.names:
+            missing = [name for name in self.species.names if name not in species.columns]
+            if missing:
+                raise ValueError("the species {} are not in the species table".format(missing))
+            matrix = np.zeros((len(compositions), len(species)))
+            matrix[:, [species.columns[name] for name in self.species.names]] = compositions
+            compositions = matrix
+        return ParticleSystem(self.column("ids")[select], self.column("masses")[select],
+                              self.column("radii")[select], self.column("displacements")[select],
+                              self.column("velocities")[select], compositions, species)
+
+    def subset_ids(self, ids, species=None):
+        return self.particles(self.slots_of_ids(ids), species)
+
+    def subset_region(self, lower, upper, species=None):
+        return self.particles(self.slots_in_region(lower, upper), species)
+
+
+def digest(path):
+    """returns the sha256 of a file, it changes whenever the particles in it do"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(CHUNK_ROWS), b""):
+            sha.update(block)
+    return sha.hexdigest()
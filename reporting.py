@@ -0,0 +1,93 @@
+"""
+Background output for long simulations
+Progress messages and images are sent through a bounded queue to a worker process that renders with Agg into
+files, so the simulation never waits for the screen or the disk. Only small messages go through the queue,
+the worker reads the paths from the trajectory files itself.
+When the queue is full the drop policy throws the message away and the block policy waits for room.
+A message that fails to render is reported and skipped, if the worker dies anyway nothing waits for it.
+"""
+import multiprocessing
+import os
+import queue
+
+QUEUE_SIZE = 4
+PUT_TIMEOUT = 1.0
+DROP = "drop"
+BLOCK = "block"
+
+
+class BackgroundReporter:
+    """starts the worker process when it is made, close waits for every message that was accepted"""
+    def __init__(self, storage_address, queue_size=QUEUE_SIZE, policy=DROP):
+        os.makedirs(storage_address, exist_ok=True)
+        self.policy = policy
+        self.dropped = 0
+        self.queue = multiprocessing.Queue(queue_size)
+        self.process = multiprocessing.Process(target=render, args=(self.queue, storage_address), daemon=True)
+        self.process.start()
+
+    def submit(self, message):
+        """hands a message to the worker, returns False if it was dropped"""
+        if self.policy == BLOCK:
+            if self.put(message):
+                return True
+            self.dropped += 1
+            return False
+        if not self.process.is_alive():
+            self.dropped += 1
+            return False
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def progress(self, text):
+        return self.submit(("progress", text))
+
+    def trajectory(self, directory, start, stop, filename, maximum_points=None):
+        """asks for an image of the paths from start up to stop, the recorder has to be flushed first"""
+        return self.submit(("trajectory", directory, start, stop, filename, maximum_points))
+
+    def put(self, message):
+        """waits for room in the queue while the worker is alive, returns False if it died"""
+        while self.process.is_alive():
+            try:
+                self.queue.put(message, timeout=PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def close(self):
+        if not self.put(None):
+            print("the renderer stopped early, exit code {}".format(self.process.exitcode))
+            self.queue.cancel_join_thread()
+        self.process.join()
+        if self.dropped:
+            print("{} reports were dropped because the renderer fell behind or stopped".format(self.dropped))
+
+
+def render(messages, storage_address):
+    """runs in the worker process until it gets None, a message that raises is reported and skipped"""
+    import image_processing as vis
+    from trajectory import TrajectoryPyramid
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+    except Exception as error:
+        print("images can't be rendered: {!r}".format(error), flush=True)
+    while True:
+        message = messages.get()
+        if message is None:
+            return
+        try:
+            if message[0] == "progress":
+                print(message[1], flush=True)
+            elif message[0] == "trajectory":
+                directory, start, stop, filename, maximum_points = message[1:]
+                vis.save_trajectory(TrajectoryPyramid(directory), start, stop, filename, storage_address,
+                                    maximum_points)
+        except Exception as error:
+            print("the {} report failed: {!r}".format(message[0], error), flush=True)
@@ -0,0 +1,89 @@
+"""
+On disk cache of simulation results
+A result is stored as one json file named after the sha256 of the configuration and of the source code, so any
+change to the code starts a new set of results. Files are written to a temporary name and moved into place so a
+reader never sees half of one, the least recently used results are removed under a lock file once there are more
+than maximum_entries of them. Several processes can share one cache directory.
+There is a list bellow
+ResultCache
+code_version
+"""
+import functools
+import glob
+import hashlib
+import json
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MAXIMUM_ENTRIES = 10000
+LOCK_FILE = ".lock"
+
+
+class ResultCache:
+    """get returns the stored result of a configuration or None, put stores one"""
+    def __init__(self, directory, maximum_entries=MAXIMUM_ENTRIES, version=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.maximum_entries = maximum_entries
+        self.version = code_version() if version is None else version
+
+    def key(self, configuration):
+        text = json.dumps({"configuration": configuration, "version": self.version}, sort_keys=True)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def path(self, configuration):
+        return os.path.join(self.directory, self.key(configuration) + ".json")
+
+    def get(self, configuration):
+        path = self.path(configuration)
+        try:
+            with open(path) as file:
+                result = json.load(file)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return result
+
+    def put(self, configuration, result):
+        path = self.path(configuration)
+        temporary = "{}.{}.tmp".format(path, os.getpid())
+        with open(temporary, "w") as file:
+            json.dump(dict(result, configuration=configuration, version=self.version), file)
+        os.replace(temporary, path)
+        self.evict()
+
+    def evict(self):
+        """removes the least recently used results until there are at most maximum_entries"""
+        entries = glob.glob(os.path.join(self.directory, "*.json"))
+        if len(entries) <= self.maximum_entries:
+            return
+        with open(os.path.join(self.directory, LOCK_FILE), "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            used = []
+            for entry in glob.glob(os.path.join(self.directory, "*.json")):
+                try:
+                    used.append((os.path.getmtime(entry), entry))
+                except OSError:
+                    pass
+            used.sort()
+            for modified, entry in used[:max(0, len(used) - self.maximum_entries)]:
+                try:
+                    os.remove(entry)
+                except OSError:
+                    pass
+
+
+@functools.lru_cache(maxsize=None)
+def code_version():
+    """returns the sha256 of every python file next to this one"""
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py"))):
+        with open(path, "rb") as file:
+            digest.update(os.path.basename(path).encode())
+            digest.update(file.read())
+    return digest.hexdigest()
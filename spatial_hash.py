@@ -0,0 +1,70 @@
+"""
+Spatial hash broad phase for the collision detection
+Particles are put into a uniform grid of cells at least as wide as the largest diameter, so two particles
+can only clip if they are in the same or neighbouring cells. Only those pairs get the exact distance check.
+"""
+import numpy as np
+
+CELL_BITS = 21
+CELL_OFFSET = 2 ** (CELL_BITS - 1)
+NEIGHBOUR_CELLS = [(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1) if (x, y, z) > (0, 0, 0)]
+
+
+class SpatialHash:
+    """keeps every particle sorted by the key of the cell it is in, the sort is updated as particles move"""
+    def __init__(self):
+        self.cell_size = None
+        self.keys = None
+        self.order = None
+        self.sorted_keys = None
+        self.moved = 0
+
+    def update(self, displacements, radii):
+        """moves the particles that changed cell, the grid is rebuilt if the number of particles changed or the
+        largest radius no longer fits the cells"""
+        largest = 2 * radii.max() if len(radii) else 1.0
+        largest = largest if largest > 0 else 1.0
+        if self.keys is None or len(self.keys) != len(radii) or largest > self.cell_size or \
+                largest < self.cell_size / 2:
+            self.cell_size = largest
+            self.keys = cell_keys(displacements, self.cell_size)
+            self.order = np.argsort(self.keys, kind="stable")
+            self.moved = len(radii)
+        else:
+            keys = cell_keys(displacements, self.cell_size)
+            self.moved = int(np.count_nonzero(keys != self.keys))
+            self.keys = keys
+            if self.moved:
+                self.order = self.order[np.argsort(keys[self.order], kind="stable")]
+        self.sorted_keys = self.keys[self.order]
+
+    def clipping_pairs(self, displacements, radii):
+        """returns every pair (i, m) with i < m that clips each other, sorted by the first then second index"""
+        self.update(displacements, radii)
+        number = len(radii)
+        positions = np.arange(number)
+        first = [positions]
+        lows = [positions + 1]
+        highs = [np.searchsorted(self.sorted_keys, self.sorted_keys, side="right")]
+        for x, y, z in NEIGHBOUR_CELLS:
+            neighbour_keys = self.sorted_keys + ((x << 2 * CELL_BITS) + (y << CELL_BITS) + z)
+            lows.append(np.searchsorted(self.sorted_keys, neighbour_keys, side="left"))
+            highs.append(np.searchsorted(self.sorted_keys, neighbour_keys, side="right"))
+            first.append(positions)
+        lows = np.concatenate(lows)
+        highs = np.concatenate(highs)
+        first = np.concatenate(first)
+        counts = np.maximum(highs - lows, 0)
+        candidates = np.repeat(first, counts)
+        others = np.repeat(lows, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        candidates, others = self.order[candidates], self.order[others]
+        distance = np.sqrt(((displacements[candidates] - displacements[others]) ** 2).sum(axis=1))
+        clipping = distance <= radii[candidates] + radii[others]
+        pairs = np.stack([np.minimum(candidates, others)[clipping], np.maximum(candidates, others)[clipping]], axis=1)
+        return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))].astype(np.int64)
+
+
+def cell_keys(displacements, cell_size):
+    """returns one integer key for the cell every particle is in"""
+    cells = np.clip(np.floor(displacements / cell_size).astype(np.int64) + CELL_OFFSET, 1, 2 ** CELL_BITS - 2)
+    return (cells[:, 0] << 2 * CELL_BITS) + (cells[:, 1] << CELL_BITS) + cells[:, 2]
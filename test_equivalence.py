@@ -0,0 +1,123 @@
+"""
+Checks that the faster paths give the same answers as the ones they replace
+The force engines are compared with the direct sum, the direct sum with the original pairwise loop, resumed runs
+with runs that never stopped and the members of an ensemble with the simulations of their seeds.
+Run with python -m pytest test_equivalence.py
+"""
+import numpy as np
+import pytest
+import calculations as cal
+from main import Simulation, CONSTANT_VALUES, COMPOSITION_CLOUD
+from object_file import Planetessimal
+from octree import BarnesHut
+from neighbour_list import NeighbourList
+from parallel_forces import ParallelDirect, SERIAL_LIMIT
+from spatial_hash import SpatialHash
+from ensemble import Ensemble
+
+GRAVITATIONAL_DISTANCE = (CONSTANT_VALUES.gravity / CONSTANT_VALUES.acceleration_error) ** 0.5
+GRAVITY = CONSTANT_VALUES.gravity
+
+
+def disk(number, radius_scale=1.0, seed=1):
+    """returns the particles a simulation starts with, radius_scale makes them clip more often"""
+    simulation = Simulation(CONSTANT_VALUES, seed, number_of_particles=number)
+    simulation.initialize()
+    particles = simulation.particles
+    particles.radii *= radius_scale
+    return particles
+
+
+def direct(particles, counters=None):
+    return cal.calculate_accelerations(particles.displacements, particles.masses, particles.radii,
+                                       GRAVITATIONAL_DISTANCE, GRAVITY, counters=counters)
+
+
+def largest_error(accelerations, expected):
+    return np.abs(accelerations - expected).max() / np.abs(expected).max()
+
+
+def test_direct_matches_pairwise_loop():
+    particles = disk(200)
+    accelerations, pairs = direct(particles)
+    assert len(pairs) == 0
+    planetessimals = []
+    for slot in range(len(particles)):
+        planetessimal = Planetessimal(slot, particles.masses[slot], particles.displacements[slot].copy(),
+                                      particles.velocities[slot].copy(), "rock")
+        planetessimal.radius = particles.radii[slot]
+        planetessimals.append(planetessimal)
+    cal.calculate_collisions(planetessimals, GRAVITATIONAL_DISTANCE, GRAVITY, COMPOSITION_CLOUD, [])
+    expected = np.array([planetessimal.acceleration for planetessimal in planetessimals])
+    assert largest_error(accelerations, expected) < 1e-15
+
+
+@pytest.mark.parametrize("engine", [NeighbourList(), ParallelDirect(2)], ids=["neighbour_list", "parallel"])
+def test_engine_matches_direct(engine):
+    particles = disk(SERIAL_LIMIT + 100, radius_scale=10)
+    expected_counters = {"pairs_evaluated": 0, "pairs_within": 0}
+    expected, expected_pairs = direct(particles, expected_counters)
+    counters = {"pairs_evaluated": 0, "pairs_within": 0}
+    try:
+        accelerations, pairs = engine(particles.displacements, particles.masses, particles.radii,
+                                      GRAVITATIONAL_DISTANCE, GRAVITY, counters=counters)
+    finally:
+        if hasattr(engine, "close"):
+            engine.close()
+    assert len(expected_pairs) > 0
+    assert largest_error(accelerations, expected) < 1e-12
+    np.testing.assert_array_equal(pairs, expected_pairs)
+    assert counters["pairs_within"] == expected_counters["pairs_within"]
+
+
+def test_spatial_hash_matches_direct_pairs():
+    particles = disk(1000, radius_scale=10)
+    expected_pairs = direct(particles)[1]
+    assert len(expected_pairs) > 0
+    np.testing.assert_array_equal(SpatialHash().clipping_pairs(particles.displacements, particles.radii),
+                                  expected_pairs)
+    np.testing.assert_array_equal(cal.calculate_overlaps(particles.displacements, particles.radii), expected_pairs)
+
+
+def test_barnes_hut_error_is_bounded():
+    particles = disk(2000)
+    mean, largest = BarnesHut(0.5).force_error(particles.displacements, particles.masses, particles.radii,
+                                               GRAVITATIONAL_DISTANCE, GRAVITY)
+    assert mean < 1e-3 and largest < 0.05
+    mean, largest = BarnesHut(0.0).force_error(particles.displacements, particles.masses, particles.radii,
+                                               GRAVITATIONAL_DISTANCE, GRAVITY)
+    assert largest < 1e-12
+
+
+@pytest.mark.parametrize("integrator", ["euler", "leapfrog", "block"])
+def test_resume_is_bit_identical(tmp_path, integrator):
+    whole = Simulation(CONSTANT_VALUES, 5, integrator=integrator, number_of_particles=60,
+                       number_of_simulations=40)
+    whole.run()
+    first = Simulation(CONSTANT_VALUES, 5, integrator=integrator, number_of_particles=60,
+                       number_of_simulations=15)
+    first.checkpoint_path = str(tmp_path / "checkpoint.npz")
+    first.run()
+    first.checkpoint(None)
+    resumed = Simulation.resume(first.checkpoint_path)
+    resumed.number_of_simulations = 40
+    resumed.run()
+    assert resumed.step == whole.step == 40
+    assert resumed.objects_cleaned == whole.objects_cleaned
+    for name in ("ids", "masses", "radii", "displacements", "velocities", "accelerations", "compositions"):
+        np.testing.assert_array_equal(getattr(resumed.particles, name), getattr(whole.particles, name))
+
+
+def test_ensemble_members_match_simulations():
+    seeds = [1, 2, 3]
+    ensemble = Ensemble(CONSTANT_VALUES, seeds)
+    ensemble.run(50)
+    for index, seed in enumerate(seeds):
+        simulation = Simulation(CONSTANT_VALUES, seed, number_of_simulations=50)
+        simulation.run()
+        member = ensemble.member(index)
+        assert ensemble.objects_cleaned[index] == simulation.objects_cleaned
+        np.testing.assert_array_equal(member.ids, simulation.particles.ids)
+        np.testing.assert_allclose(member.masses, simulation.particles.masses, rtol=1e-12)
+        np.testing.assert_allclose(member.displacements, simulation.particles.displacements, rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(member.velocities, simulation.particles.velocities, rtol=1e-9, atol=1e-9)
@@ -0,0 +1,305 @@
+"""
+Streaming storage for the paths of the particles
+Every step is written into a preallocated float32 buffer of (steps, particles, 4) values (x, y, z, radius),
+when it is full it is saved as one .npy chunk and reused. Removed particles are stored as nan.
+The reader memory maps the chunks so one particle or one window of steps can be read without loading the rest.
+A recording policy decides which samples are kept and a pyramid keeps coarser copies for long runs.
+There is a list bellow
+EveryStep
+Stride
+Adaptive
+TrajectoryRecorder
+TrajectoryReader
+PyramidRecorder
+TrajectoryPyramid
+"""
+import json
+import os
+import numpy as np
+
+CHUNK_STEPS = 1024
+CHUNK_BYTES = 64 * 1024 ** 2
+INDEX_FILE = "index.json"
+PYRAMID_LEVELS = 3
+PYRAMID_FACTOR = 16
+
+
+class EveryStep:
+    """keeps every sample"""
+    def add(self, step, row):
+        """returns the (step, row) pairs to write, values that are not kept are nan"""
+        return [(step, row)]
+
+    def finish(self):
+        return []
+
+
+class Stride:
+    """keeps every stride-th step and the last step"""
+    def __init__(self, stride):
+        self.stride = stride
+        self.last = None
+
+    def add(self, step, row):
+        if step % self.stride == 0:
+            self.last = None
+            return [(step, row)]
+        self.last = (step, row.copy())
+        return []
+
+    def finish(self):
+        return [] if self.last is None else [self.last]
+
+
+class Adaptive:
+    """keeps a sample of a particle only when the straight line from its last kept sample to the newest one
+    would pass further than the tolerance from any sample dropped since then, so smooth parts of the path are
+    stored with very few points.
+    Every dropped sample allows the velocities of the line inside a sphere, the policy keeps one sphere per
+    particle that lies inside all of them so the check costs the same however many samples were dropped"""
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+        self.anchor = None
+        self.anchor_step = None
+        self.center = None
+        self.radius = None
+        self.previous = None
+        self.previous_step = None
+
+    def add(self, step, row):
+        written = []
+        if self.previous is None:
+            self.anchor = row.astype(float)
+            self.anchor_step = np.full(len(row), step, dtype=np.int64)
+            self.center = np.zeros((len(row), 3))
+            self.radius = np.full(len(row), np.inf)
+            written.append((step, row))
+        else:
+            velocity = (row[:, :3] - self.anchor[:, :3]) / np.maximum(step - self.anchor_step, 1)[:, None]
+            with np.errstate(invalid="ignore"):
+                outside = ~(np.sqrt(((velocity - self.center) ** 2).sum(axis=1)) <= self.radius)
+            pending = ~np.isnan(self.previous[:, 0]) & (self.anchor_step < self.previous_step)
+            keep = pending & (outside | np.isnan(row[:, 0]))
+            if keep.any():
+                written.append((self.previous_step, np.where(keep[:, None], self.previous, np.nan)))
+                self.anchor[keep] = self.previous[keep]
+                self.anchor_step[keep] = self.previous_step
+                self.radius[keep] = np.inf
+            self.narrow(step, row)
+            removed = np.isnan(row[:, 0])
+            self.anchor[removed] = np.nan
+        self.previous = row.copy()
+        self.previous_step = step
+        return written
+
+    def narrow(self, step, row):
+        """shrinks the sphere of every particle to the largest one on the line between the centres that also
+        lies inside the sphere of the velocities that pass within the tolerance of the new sample"""
+        span = np.maximum(step - self.anchor_step, 1)
+        center = (row[:, :3] - self.anchor[:, :3]) / span[:, None]
+        radius = self.tolerance / span
+        offset = center - self.center
+        distance = np.sqrt((offset ** 2).sum(axis=1))
+        with np.errstate(invalid="ignore"):
+            empty = distance > self.radius + radius
+            replace = (self.radius == np.inf) | (distance + radius <= self.radius)
+            lens = ~replace & ~empty & (distance + self.radius > radius)
+        low = distance[lens] - radius[lens]
+        high = self.radius[lens]
+        along = (low + high) / 2 / np.where(distance[lens] > 0, distance[lens], 1)
+        self.center[lens] += offset[lens] * along[:, None]
+        self.radius[lens] = (high - low) / 2
+        self.center[replace] = center[replace]
+        self.radius[replace] = radius[replace]
+        self.radius[empty & ~replace] = -np.inf
+
+    def finish(self):
+        if self.previous is None:
+            return []
+        pending = ~np.isnan(self.previous[:, 0]) & (self.anchor_step < self.previous_step)
+        if not pending.any():
+            return []
+        return [(self.previous_step, np.where(pending[:, None], self.previous, np.nan))]
+
+
+class TrajectoryRecorder:
+    """records the particles with the ids given when it was made, the column of an id never changes,
+    resume_from carries on an earlier recording in the directory, keeping only its chunks before that step,
+    without chunk_steps a chunk holds as many steps as fit in CHUNK_BYTES, up to CHUNK_STEPS"""
+    def __init__(self, directory, ids, chunk_steps=None, policy=None, resume_from=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.policy = EveryStep() if policy is None else policy
+        self.ids = np.array(ids, dtype=np.int64)
+        self.columns = np.full(self.ids.max() + 1, -1, dtype=np.int64)
+        self.columns[self.ids] = np.arange(len(self.ids))
+        self.row = np.empty((len(self.ids), 4), dtype=np.float32)
+        self.count = 0
+        self.chunks = []
+        if resume_from is not None and os.path.exists(os.path.join(directory, INDEX_FILE)):
+            reader = TrajectoryReader(directory)
+            self.ids = reader.ids
+            self.columns = np.full(self.ids.max() + 1, -1, dtype=np.int64)
+            self.columns[self.ids] = np.arange(len(self.ids))
+            self.row = np.empty((len(self.ids), 4), dtype=np.float32)
+            self.chunks = [chunk for chunk in reader.chunks if chunk["last"] < resume_from]
+        if chunk_steps is None:
+            chunk_steps = max(1, min(CHUNK_STEPS, CHUNK_BYTES // max(1, self.row.nbytes)))
+        self.buffer = np.empty((chunk_steps, len(self.ids), 4), dtype=np.float32)
+        self.steps = np.empty(chunk_steps, dtype=np.int64)
+
+    def add(self, step, particles):
+        """adds the displacement and radius of every particle at a step, if the policy keeps them"""
+        self.row[:] = np.nan
+        columns = self.columns[particles.ids]
+        self.row[columns, :3] = particles.displacements
+        self.row[columns, 3] = particles.radii
+        for kept_step, row in self.policy.add(step, self.row):
+            self.write(kept_step, row)
+
+    def write(self, step, row):
+        """puts a row into the buffer, saving the buffer when it is full"""
+        self.buffer[self.count] = row
+        self.steps[self.count] = step
+        self.count += 1
+        if self.count == len(self.steps):
+            self.flush()
+
+    def flush(self):
+        """saves the buffered steps as a chunk and updates the index"""
+        if not self.count:
+            return
+        name = "chunk_{:06d}".format(len(self.chunks))
+        np.save(os.path.join(self.directory, name + ".npy"), self.buffer[:self.count])
+        np.save(os.path.join(self.directory, name + "_steps.npy"), self.steps[:self.count])
+        self.chunks.append({"name": name, "first": int(self.steps[0]), "last": int(self.steps[self.count - 1]),
+                            "rows": self.count})
+        self.count = 0
+        write_index(self.directory, {"ids": self.ids.tolist(), "chunks": self.chunks})
+
+    def close(self):
+        for step, row in self.policy.finish():
+            self.write(step, row)
+        self.flush()
+
+
+class TrajectoryReader:
+    """reads the chunks written by a TrajectoryRecorder"""
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE)) as file:
+            index = json.load(file)
+        self.ids = np.array(index["ids"], dtype=np.int64)
+        self.columns = {id_value: column for column, id_value in enumerate(index["ids"])}
+        self.chunks = index["chunks"]
+
+    def chunk(self, chunk):
+        """returns the memory mapped values and the steps of a chunk"""
+        path = os.path.join(self.directory, chunk["name"])
+        return np.load(path + ".npy", mmap_mode="r"), np.load(path + "_steps.npy")
+
+    def select(self, start=None, stop=None):
+        """yields the values, steps and rows of every chunk that holds steps from start up to stop"""
+        for chunk in self.chunks:
+            if (stop is not None and chunk["first"] >= stop) or (start is not None and chunk["last"] < start):
+                continue
+            values, steps = self.chunk(chunk)
+            first = 0 if start is None else np.searchsorted(steps, start)
+            last = len(steps) if stop is None else np.searchsorted(steps, stop)
+            yield values, steps, slice(first, last)
+
+    def rows(self, start=None, stop=None):
+        """returns about how many rows are stored from start up to stop, counting whole chunks"""
+        return sum(chunk["rows"] for chunk in self.chunks
+                   if not ((stop is not None and chunk["first"] >= stop) or (start is not None and chunk["last"] < start)))
+
+    def body(self, id_value, start=None, stop=None, maximum_points=None):
+        """returns the steps and the (x, y, z, radius) values of one particle, leaving out steps where it wasn't
+        kept, at most maximum_points are returned"""
+        column = self.columns[id_value]
+        steps = []
+        values = []
+        for chunk_values, chunk_steps, rows in self.select(start, stop):
+            steps.append(chunk_steps[rows])
+            values.append(np.array(chunk_values[rows, column]))
+        if not steps:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 4), dtype=np.float32)
+        steps, values = np.concatenate(steps), np.concatenate(values)
+        present = ~np.isnan(values[:, 0])
+        return thin(steps[present], values[present], maximum_points)
+
+    def window(self, start=None, stop=None, maximum_points=None):
+        """returns the steps and the (steps, particles, 4) values from start up to stop, at most maximum_points
+        rows are returned"""
+        steps = []
+        values = []
+        for chunk_values, chunk_steps, rows in self.select(start, stop):
+            steps.append(chunk_steps[rows])
+            values.append(np.array(chunk_values[rows]))
+        if not steps:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, len(self.ids), 4), dtype=np.float32)
+        return thin(np.concatenate(steps), np.concatenate(values), maximum_points)
+
+
+class PyramidRecorder:
+    """records the full resolution path with the policy into level_0 and coarser copies into level_1 and up,
+    level k keeps every factor ** k-th step of the stride of the policy, or of every step for other policies"""
+    def __init__(self, directory, ids, levels=PYRAMID_LEVELS, factor=PYRAMID_FACTOR, chunk_steps=None,
+                 policy=None, resume_from=None):
+        self.directory = directory
+        self.levels = [TrajectoryRecorder(os.path.join(directory, "level_0"), ids, chunk_steps, policy, resume_from)]
+        stride = getattr(policy, "stride", 1)
+        for level in range(1, levels):
+            self.levels.append(TrajectoryRecorder(os.path.join(directory, "level_{}".format(level)), ids,
+                                                  chunk_steps, Stride(stride * factor ** level), resume_from))
+
+    def add(self, step, particles):
+        for recorder in self.levels:
+            recorder.add(step, particles)
+
+    def flush(self):
+        for recorder in self.levels:
+            recorder.flush()
+
+    def close(self):
+        for recorder in self.levels:
+            recorder.close()
+
+
+class TrajectoryPyramid:
+    """reads a PyramidRecorder, every read uses the finest level that fits in the number of points asked for"""
+    def __init__(self, directory):
+        self.levels = []
+        while os.path.exists(os.path.join(directory, "level_{}".format(len(self.levels)), INDEX_FILE)):
+            self.levels.append(TrajectoryReader(os.path.join(directory, "level_{}".format(len(self.levels)))))
+        self.ids = self.levels[0].ids
+
+    def level(self, start, stop, maximum_points):
+        """returns the finest level with at most maximum_points rows between start and stop"""
+        if maximum_points is not None:
+            for reader in self.levels:
+                if reader.rows(start, stop) <= maximum_points:
+                    return reader
+        return self.levels[0] if maximum_points is None else self.levels[-1]
+
+    def body(self, id_value, start=None, stop=None, maximum_points=None):
+        return self.level(start, stop, maximum_points).body(id_value, start, stop, maximum_points)
+
+    def window(self, start=None, stop=None, maximum_points=None):
+        return self.level(start, stop, maximum_points).window(start, stop, maximum_points)
+
+
+def thin(steps, values, maximum_points):
+    """keeps evenly spaced samples so there are at most maximum_points, always keeping the last one"""
+    if maximum_points is None or len(steps) <= maximum_points:
+        return steps, values
+    keep = np.unique(np.linspace(0, len(steps) - 1, maximum_points).round().astype(np.int64))
+    return steps[keep], values[keep]
+
+
+def write_index(directory, index):
+    """replaces the index in one step so a reader never sees half of it"""
+    path = os.path.join(directory, INDEX_FILE)
+    with open(path + ".tmp", "w") as file:
+        json.dump(index, file)
+    os.replace(path + ".tmp", path)
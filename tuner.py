@@ -0,0 +1,124 @@
+"""
+Successive halving tuner for the OptimisableValues
+Every candidate is first run for a few steps, only the best 1 / reduction of them are run again for reduction
+times as many steps, until the survivors reach the full length.
+Inside a rung a run is stopped early once its fitness can no longer beat the candidates already promoted,
+the fitness only goes down as objects are cleaned and time passes so this never stops a run that would be promoted.
+Every run leaves a checkpoint behind, so a promoted candidate carries on from the end of its last rung instead of
+running its first steps again.
+There is a list bellow
+SuccessiveHalving
+hyperband
+evaluate_steps
+"""
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import numpy as np
+from main import Simulation, NUMBER_OF_SIMULATIONS, RESULT_CACHE, STORAGE_ADDRESS
+from result_cache import ResultCache
+from optimiser import WORKERS
+
+REDUCTION = 3
+MINIMUM_STEPS = 1000
+
+
+def evaluate_steps(constant_values, seed, steps, minimum_fitness, checkpoint_path=None):
+    """runs one candidate for up to steps steps and returns its fitness and how many steps it ran,
+    with a checkpoint_path the run carries on from the checkpoint there and leaves its own one behind"""
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        simulation = Simulation.resume(checkpoint_path)
+        simulation.number_of_simulations = steps
+        simulation.minimum_fitness = minimum_fitness
+    else:
+        simulation = Simulation(constant_values, seed, number_of_simulations=steps, minimum_fitness=minimum_fitness,
+                                cache=ResultCache(RESULT_CACHE))
+        if checkpoint_path is not None:
+            simulation.checkpoint_path = checkpoint_path
+    first_step = simulation.step
+    fitness = simulation.run()
+    if checkpoint_path is not None and simulation.particles is not None:
+        simulation.checkpoint(None)
+    return fitness, simulation.step - first_step
+
+
+class SuccessiveHalving:
+    """runs rungs of reduction times as many steps each, from minimum_steps up to maximum_steps,
+    steps_run counts the steps that were actually simulated"""
+    def __init__(self, candidates, minimum_steps=MINIMUM_STEPS, maximum_steps=NUMBER_OF_SIMULATIONS,
+                 reduction=REDUCTION, workers=WORKERS, seed=1, objective=evaluate_steps):
+        self.candidates = list(candidates)
+        self.minimum_steps = minimum_steps
+        self.maximum_steps = maximum_steps
+        self.reduction = reduction
+        self.workers = workers
+        self.seed = seed
+        self.objective = objective
+        self.steps_run = 0
+        self.history = []
+
+    def rungs(self):
+        """returns the number of steps of every rung"""
+        steps = []
+        rung_steps = self.minimum_steps
+        while rung_steps < self.maximum_steps:
+            steps.append(rung_steps)
+            rung_steps *= self.reduction
+        return steps + [self.maximum_steps]
+
+    def run(self):
+        """returns the best candidate and its fitness over the full length"""
+        candidates = self.candidates
+        rungs = self.rungs()
+        os.makedirs(STORAGE_ADDRESS, exist_ok=True)
+        directory = tempfile.mkdtemp(prefix="tuner_", dir=STORAGE_ADDRESS)
+        checkpoints = [os.path.join(directory, "candidate_{}.npz".format(index)) for index in range(len(candidates))]
+        try:
+            with multiprocessing.Pool(self.workers) as pool:
+                for rung, steps in enumerate(rungs):
+                    keep = 1 if rung == len(rungs) - 1 else max(1, len(candidates) // self.reduction)
+                    results = self.evaluate_rung(pool, candidates, steps, keep, checkpoints)
+                    order = np.argsort(results)[::-1]
+                    self.history.append((steps, len(candidates), results[order[0]]))
+                    print("rung {} ran {} candidates for {} steps, the best had a value {}".format(
+                        rung, len(candidates), steps, results[order[0]]))
+                    candidates = [candidates[index] for index in order[:keep]]
+                    checkpoints = [checkpoints[index] for index in order[:keep]]
+                    best_fitness = results[order[0]]
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        return candidates[0], best_fitness
+
+    def evaluate_rung(self, pool, candidates, steps, keep, checkpoints):
+        """runs the candidates a batch of workers at a time from their checkpoints, later batches are stopped early
+        once they can't reach the keep best fitnesses found so far"""
+        results = []
+        for first in range(0, len(candidates), self.workers):
+            finished = sorted(results, reverse=True)
+            minimum_fitness = finished[keep - 1] if len(finished) >= keep else None
+            batch = [pool.apply_async(self.objective, (values, self.seed, steps, minimum_fitness, path))
+                     for values, path in zip(candidates[first:first + self.workers],
+                                             checkpoints[first:first + self.workers])]
+            for result in batch:
+                fitness, steps_done = result.get()
+                results.append(fitness)
+                self.steps_run += steps_done
+        return results
+
+
+def hyperband(constant_values, maximum_steps=NUMBER_OF_SIMULATIONS, minimum_steps=MINIMUM_STEPS,
+              reduction=REDUCTION, workers=WORKERS, seed=1, objective=evaluate_steps):
+    """runs successive halving brackets that trade how many candidates are tried against how short their first
+    run is and returns the best candidate of all the brackets with its fitness"""
+    random = np.random.default_rng(seed)
+    brackets = int(math.log(maximum_steps / minimum_steps, reduction)) if maximum_steps > minimum_steps else 0
+    best = []
+    for bracket in range(brackets, -1, -1):
+        number = int(math.ceil((brackets + 1) / (bracket + 1) * reduction ** bracket))
+        candidates = [constant_values.return_variation(random) for candidate in range(number)]
+        tuner = SuccessiveHalving(candidates, max(1, maximum_steps // reduction ** bracket), maximum_steps,
+                                  reduction, workers, seed, objective)
+        best.append(tuner.run())
+    return max(best, key=lambda pair: pair[1])